@@ -6,8 +6,15 @@ from typing import Optional, Dict, Any
 from jose import JWTError, jwt, ExpiredSignatureError
 from passlib.context import CryptContext
 from models import User, TokenData, LoginRequest
-from database import users_collection
+from database import users_collection, signing_keys_collection
+from utils.cache import TTLCache
+from utils.key_registry import KeyRegistry, generate_secret, key_id_for
+from utils.metrics import jwt_verification_duration
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import hashlib
 import logging
+import time
 import warnings
 import os
 from dotenv import load_dotenv
@@ -15,8 +22,7 @@ from dotenv import load_dotenv
 # Carrega variáveis de ambiente
 load_dotenv()
 
-# Configurando logging para capturar detalhes do erro
-logging.basicConfig(level=logging.INFO)
+# Níveis e destino dos logs são configurados em utils/logging_setup.py
 logger = logging.getLogger(__name__)
 
 # Silenciar avisos específicos do bcrypt no passlib
@@ -50,12 +56,57 @@ for i, key in enumerate(ALTERNATE_SECRET_KEYS):
     if key:
         logger.info(f"Chave alternativa {i+1} disponível (primeiros 5 caracteres): {key[:5]}...")
 
+# Registro de chaves: novos tokens levam o "kid" da chave ativa no header e são
+# verificados direto com ela. Tokens antigos (sem "kid") testam no máximo
+# JWT_LEGACY_KEY_FALLBACK_LIMIT chaves, na ordem principal -> alternativas.
+JWT_LEGACY_KEY_FALLBACK_LIMIT = int(os.getenv("JWT_LEGACY_KEY_FALLBACK_LIMIT", str(1 + len(ALTERNATE_SECRET_KEYS))))
+key_registry = KeyRegistry(legacy_fallback_limit=JWT_LEGACY_KEY_FALLBACK_LIMIT)
+key_registry.register(SECRET_KEY, activate=True)
+for alt_key in ALTERNATE_SECRET_KEYS:
+    key_registry.register(alt_key)
+
+# Chaves rotacionadas em tempo de execução ficam na coleção signing_keys, para que
+# todos os workers as conheçam: cada um recarrega a coleção na inicialização, a cada
+# SIGNING_KEYS_SYNC_SECONDS e ao receber um token com "kid" desconhecido (no máximo
+# uma vez a cada SIGNING_KEYS_RELOAD_MIN_INTERVAL_SECONDS).
+SIGNING_KEYS_SYNC_SECONDS = float(os.getenv("SIGNING_KEYS_SYNC_SECONDS", "30"))
+SIGNING_KEYS_RELOAD_MIN_INTERVAL_SECONDS = float(os.getenv("SIGNING_KEYS_RELOAD_MIN_INTERVAL_SECONDS", "1"))
+_signing_keys_loaded_at = 0.0
+
+# Usuários autorizados nos endpoints administrativos sensíveis (lista separada por vírgulas).
+# Vazia por padrão: sem configuração, ninguém tem acesso.
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
+
+
+class UnknownSigningKeyError(JWTError):
+    """Token com "kid" que este processo não conhece (pode ter sido criado por outro worker)"""
+
+# Cache de payloads de tokens já verificados, indexado pelo hash do token.
+# Cada entrada expira junto com o próprio token (claim "exp"), nunca depois.
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", "10000"))
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "300"))
+token_cache = TTLCache(max_entries=TOKEN_CACHE_MAX_ENTRIES, ttl_seconds=TOKEN_CACHE_TTL_SECONDS)
+
+# Cache de usuários por username, evitando uma consulta ao Mongo por requisição.
+# Deve ser invalidado sempre que um usuário é criado ou alterado (invalidate_user_cache).
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "1000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+user_cache = TTLCache(max_entries=USER_CACHE_MAX_ENTRIES, ttl_seconds=USER_CACHE_TTL_SECONDS)
+
 # Armazenamento temporário de refresh tokens (em produção, usar Redis ou banco de dados)
 refresh_tokens = {}
 
 # Context para hash de senhas
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# O bcrypt bloqueia por dezenas de milissegundos: roda em um executor dedicado,
+# com no máximo PASSWORD_HASH_CONCURRENCY operações simultâneas. Requisições que
+# esperarem mais de PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS por uma vaga recebem 503.
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", "4"))
+PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS", "5"))
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONCURRENCY, thread_name_prefix="bcrypt")
+_password_slots = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+
 def verify_password(plain_password, hashed_password):
     """Verifica se a senha em texto claro corresponde à senha hash"""
     return pwd_context.verify(plain_password, hashed_password)
@@ -64,25 +115,129 @@ def get_password_hash(password):
     """Gera um hash para a senha fornecida"""
     return pwd_context.hash(password)
 
+async def run_password_task(func, *args):
+    """Executa uma operação de bcrypt no executor dedicado, sem bloquear o event loop"""
+    try:
+        await asyncio.wait_for(_password_slots.acquire(), timeout=PASSWORD_HASH_QUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning("Fila de verificação de senha cheia; requisição recusada")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado, tente novamente em instantes",
+            headers={"Retry-After": "1"}
+        )
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        _password_slots.release()
+
+async def verify_password_async(plain_password, hashed_password):
+    """Versão não bloqueante de verify_password"""
+    return await run_password_task(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """Versão não bloqueante de get_password_hash"""
+    return await run_password_task(get_password_hash, password)
+
 async def get_user(username: str):
-    """Busca um usuário pelo nome de usuário"""
+    """Busca um usuário pelo nome de usuário (com cache de curta duração)"""
+    if (user := user_cache.get(username)) is not None:
+        return user
+
     if (user_doc := await users_collection.find_one({"username": username})):
-        return User(
+        user = User(
             id=str(user_doc["_id"]),
             username=user_doc["username"],
+            email=user_doc.get("email") or None,
+            profile_picture=user_doc.get("profile_picture"),
             password=user_doc["password"]
         )
+        user_cache.set(username, user)
+        return user
     return None
 
+def invalidate_user_cache(*usernames: str):
+    """Remove usuários do cache após criação ou alteração de seus dados"""
+    for username in usernames:
+        user_cache.pop(username)
+
 async def authenticate_user(username: str, password: str):
     """Autentica um usuário verificando nome de usuário e senha"""
     user = await get_user(username)
     if not user:
         return None
-    if not verify_password(password, user.password):
+    if not await verify_password_async(password, user.password):
         return None
     return user
 
+def _sign(claims: dict) -> str:
+    """Assina as claims com a chave ativa, identificando-a pelo "kid" no header"""
+    kid, key = key_registry.active()
+    return jwt.encode(claims, key, algorithm=ALGORITHM, headers={"kid": kid})
+
+async def load_signing_keys(min_interval: float = 0) -> bool:
+    """
+    Aplica ao registro local as chaves persistidas por qualquer worker.
+    Retorna True se algo mudou. Com min_interval, não recarrega se a última
+    leitura foi há menos de min_interval segundos.
+    """
+    global _signing_keys_loaded_at
+    now = time.monotonic()
+    if min_interval and now - _signing_keys_loaded_at < min_interval:
+        return False
+    _signing_keys_loaded_at = now
+
+    stored = await signing_keys_collection.find({}).sort("created_at", 1).to_list(length=None)
+    changes = key_registry.sync(stored)
+    if changes["retired"]:
+        # Tokens em cache podem ter sido verificados com as chaves removidas
+        token_cache.clear()
+    if changes["added"] or changes["activated"] or changes["retired"]:
+        logger.info(f"Chaves de assinatura sincronizadas: {changes}")
+        return True
+    return False
+
+async def rotate_signing_key() -> str:
+    """
+    Troca a chave que assina novos tokens sem reiniciar a aplicação.
+    A chave é gerada aqui e gravada antes de ser usada, para que os demais
+    workers consigam verificar os tokens que ela assinar.
+    Tokens emitidos com a chave anterior continuam válidos até expirarem.
+    """
+    secret = generate_secret()
+    kid = key_id_for(secret)
+    await signing_keys_collection.update_many({"active": True}, {"$set": {"active": False}})
+    await signing_keys_collection.insert_one({
+        "_id": kid,
+        "secret": secret,
+        "active": True,
+        "retired": False,
+        "created_at": datetime.utcnow(),
+    })
+    key_registry.register(secret, activate=True, legacy=False)
+    logger.info(f"Nova chave de assinatura ativa: kid={kid}")
+    return kid
+
+async def retire_signing_key(kid: str) -> bool:
+    """Remove uma chave; tokens assinados com ela deixam de ser aceitos (nos demais workers, após a sincronização)"""
+    await load_signing_keys()
+    if kid == key_registry.active_kid:
+        raise ValueError("Não é possível remover a chave de assinatura ativa")
+    if key_registry.get(kid) is None:
+        return False
+    # Chaves do .env também são marcadas, para continuarem removidas após reinícios
+    await signing_keys_collection.update_one(
+        {"_id": kid},
+        {"$set": {"retired": True, "active": False}, "$unset": {"secret": ""},
+         "$setOnInsert": {"created_at": datetime.utcnow()}},
+        upsert=True
+    )
+    removed = key_registry.retire(kid)
+    if removed:
+        token_cache.clear()
+        logger.info(f"Chave de assinatura removida: kid={kid}")
+    return removed
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     """Cria um novo token de acesso JWT"""
     to_encode = data.copy()
@@ -93,15 +248,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    return _sign(to_encode)
 
 def create_refresh_token(data: dict):
     """Cria um token de atualização com prazo mais longo"""
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = _sign(to_encode)
     
     # Armazenar o token de atualização (em produção, usar banco de dados)
     username = data.get("sub")
@@ -109,41 +263,206 @@ def create_refresh_token(data: dict):
     
     return encoded_jwt
 
-def verify_token_with_multiple_keys(token: str):
+def _token_digest(token: str) -> str:
+    """Chave do cache de tokens: o token em si nunca fica guardado em memória"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def get_cached_token_payload(token: str) -> Optional[Dict[str, Any]]:
+    """Retorna o payload de um token já verificado e ainda não expirado, ou None"""
+    cached = token_cache.get(_token_digest(token))
+    return dict(cached[0]) if cached is not None else None
+
+def cache_token_payload(token: str, payload: Dict[str, Any], key_info: Optional[str] = None):
+    """Guarda o payload de um token verificado até a sua expiração"""
+    token_cache.set(_token_digest(token), (dict(payload), key_info), expires_at=payload.get("exp"))
+
+def decode_token(token: str):
     """
-    Tenta verificar um token JWT com múltiplas chaves possíveis.
-    Retorna o payload se uma das chaves funcionar.
+    Verifica a assinatura de um token JWT com a chave indicada pelo "kid" ou,
+    para tokens legados, com a chave principal e as alternativas.
+
+    Retorna uma tupla (payload, kid, expired). Tokens expirados com assinatura
+    válida são retornados com expired=True em vez de gerar exceção.
     """
-    logger.info(f"Verificando token: {token[:10]}...")  # Log do token recebido
-    last_error = None
-    
-    # Primeiro tenta com a chave principal
+    start = time.perf_counter()
+    cached = token_cache.get(_token_digest(token))
+    if cached is not None:
+        payload, key_info = cached
+        jwt_verification_duration.observe(time.perf_counter() - start, result="cached")
+        return dict(payload), key_info, False
+
+    result = "invalid"
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        logger.info("Token verificado com a chave principal")
-        return payload
-    except JWTError as e:
-        last_error = e
-        logger.warning(f"Falha na verificação com chave principal: {str(e)}")
-    
-    # Tenta com cada chave alternativa
-    for i, alt_key in enumerate(ALTERNATE_SECRET_KEYS):
+        payload, key_info, expired = _verify_token_signature(token)
+        result = "expired" if expired else "valid"
+        return payload, key_info, expired
+    finally:
+        jwt_verification_duration.observe(time.perf_counter() - start, result=result)
+
+def _verify_token_signature(token: str):
+    """Verificação efetiva (sem cache) usada por decode_token"""
+    logger.debug("Verificando token: %s...", token[:10])
+    kid = jwt.get_unverified_header(token).get("kid")
+    if kid is not None and not isinstance(kid, str):
+        # Header não verificado: qualquer tipo pode chegar aqui
+        raise JWTError("kid inválido")
+    if kid is not None:
+        # Token com "kid": uma única verificação, com a chave indicada
+        key = key_registry.get(kid)
+        if key is None:
+            logger.error(f"Token assinado com chave desconhecida: kid={kid}")
+            raise UnknownSigningKeyError("Chave de assinatura desconhecida")
+        candidates = [(kid, key)]
+    else:
+        # Token legado: número limitado de tentativas
+        candidates = key_registry.legacy_keys()
+
+    last_error = JWTError("Nenhuma chave disponível para verificar o token")
+    for i, (key_info, key) in enumerate(candidates):
         try:
-            payload = jwt.decode(token, alt_key, algorithms=[ALGORITHM])
-            logger.info(f"Token verificado com chave alternativa {i+1}")
-            return payload
+            payload = jwt.decode(token, key, algorithms=[ALGORITHM], options={"verify_exp": False})
         except JWTError as e:
-            logger.warning(f"Falha na verificação com chave alternativa {i+1}: {str(e)}")
-    
+            if i == 0:
+                last_error = e
+            logger.warning(f"Falha na verificação com chave {key_info}: {str(e)}")
+            continue
+
+        exp = payload.get("exp")
+        if exp is not None and not isinstance(exp, (int, float)):
+            raise JWTError("Expiration Time claim (exp) must be an integer.")
+
+        expired = exp is not None and exp <= time.time()
+        if not expired:
+            cache_token_payload(token, payload, key_info)
+        logger.debug("Token verificado com chave %s%s", key_info, " (expirado)" if expired else "")
+        return payload, key_info, expired
+
     # Se chegou aqui, nenhuma chave funcionou
     logger.error(f"Erro ao verificar token com múltiplas chaves: {last_error}")
     raise last_error
 
+def verify_token_with_multiple_keys(token: str):
+    """
+    Tenta verificar um token JWT com múltiplas chaves possíveis.
+    Retorna o payload se uma das chaves funcionar.
+    Tokens já verificados são servidos pelo cache sem nova verificação HMAC.
+    """
+    payload, _, expired = decode_token(token)
+    if expired:
+        raise ExpiredSignatureError("Signature has expired.")
+    return payload
+
+def authenticate_request(request: Request) -> Optional[Dict[str, Any]]:
+    """
+    Etapa única de autenticação da requisição: lê o header Authorization e
+    decodifica o token uma só vez, guardando o resultado em request.state:
+
+    - token: token bruto (None se o header estiver ausente ou mal formatado)
+    - token_payload: claims do token (None se inválido)
+    - token_key: "kid" da chave que validou a assinatura
+    - token_expired: True se a assinatura é válida mas o token expirou
+    - token_error: mensagem de erro da verificação, se houver
+
+    Chamadas subsequentes na mesma requisição apenas retornam o payload já decodificado.
+    """
+    state = request.state
+    if getattr(state, "token_checked", False):
+        return state.token_payload
+
+    state.token_checked = True
+    state.token = None
+    state.token_payload = None
+    state.token_key = None
+    state.token_expired = False
+    state.token_error = None
+    state.token_unknown_kid = False
+
+    auth_header = request.headers.get("Authorization")
+    if not auth_header or not auth_header.startswith("Bearer "):
+        return None
+
+    state.token = auth_header[len("Bearer "):]
+    try:
+        payload, key_info, expired = decode_token(state.token)
+    except JWTError as e:
+        state.token_error = str(e)
+        state.token_unknown_kid = isinstance(e, UnknownSigningKeyError)
+        return None
+
+    state.token_payload = payload
+    state.token_key = key_info
+    state.token_expired = expired
+    return payload
+
+async def authenticate_request_with_key_reload(request: Request) -> Optional[Dict[str, Any]]:
+    """
+    authenticate_request que, diante de um "kid" desconhecido, recarrega as chaves
+    compartilhadas (outro worker pode ter acabado de rotacionar) e tenta de novo.
+    """
+    payload = authenticate_request(request)
+    if payload is None and request.state.token_unknown_kid:
+        if await load_signing_keys(min_interval=SIGNING_KEYS_RELOAD_MIN_INTERVAL_SECONDS):
+            request.state.token_checked = False
+            payload = authenticate_request(request)
+    return payload
+
+async def _user_from_request(request: Request, allow_expired: bool):
+    """Resolve o usuário autenticado a partir do estado preenchido por authenticate_request"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Token inválido" if allow_expired else "Não autorizado",
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+    payload = authenticate_request(request)
+    if request.state.token is None:
+        logger.error("Authorization header ausente ou mal formatado")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token não fornecido",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    if payload is None:
+        logger.error(f"Erro JWT: {request.state.token_error}")
+        raise credentials_exception
+    if request.state.token_expired and not allow_expired:
+        logger.error("Erro JWT: token expirado")
+        raise credentials_exception
+
+    username: str = payload.get("sub")
+    if username is None:
+        logger.error("Token não contém 'sub' claim")
+        raise credentials_exception
+
+    # Usuário já resolvido por outra dependência nesta mesma requisição
+    current_user = getattr(request.state, "current_user", None)
+    if current_user is not None and current_user.username == username:
+        return current_user
+
+    user = await get_user(username=username)
+    if user is None:
+        logger.error(f"Usuário não encontrado: {username}")
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Usuário não encontrado" if allow_expired else "Não autorizado",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+    request.state.username = username
+    request.state.current_user = user
+    return user
+
 async def renew_access_token(refresh_token: str):
     """Renova um token de acesso usando o token de atualização"""
     try:
         # Tenta verificar com múltiplas chaves
-        payload = verify_token_with_multiple_keys(refresh_token)
+        try:
+            payload = verify_token_with_multiple_keys(refresh_token)
+        except UnknownSigningKeyError:
+            # Token assinado por uma chave criada em outro worker
+            if not await load_signing_keys(min_interval=SIGNING_KEYS_RELOAD_MIN_INTERVAL_SECONDS):
+                raise
+            payload = verify_token_with_multiple_keys(refresh_token)
         username = payload.get("sub")
         
         if not username or refresh_tokens.get(username) != refresh_token:
@@ -164,122 +483,26 @@ async def renew_access_token(refresh_token: str):
             headers={"WWW-Authenticate": "Bearer"}
         )
 
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    """Obtém o usuário atual com base no token JWT fornecido"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Não autorizado",
-        headers={"WWW-Authenticate": "Bearer"}
-    )
-    
-    try:
-        # Tenta verificar o token com múltiplas chaves
-        payload = verify_token_with_multiple_keys(token)
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username, exp=payload.get("exp"))
-    except JWTError as e:
-        logger.error(f"Erro JWT em get_current_user: {str(e)}")
-        raise credentials_exception
-        
-    user = await get_user(username=token_data.username)
-    if user is None:
-        logger.error(f"Usuário não encontrado: {token_data.username}")
-        raise credentials_exception
-        
-    return user
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme)):
+    """
+    Obtém o usuário atual com base no token JWT fornecido.
+    O token é decodificado uma única vez por requisição (ver authenticate_request).
+    """
+    return await _user_from_request(request, allow_expired=False)
 
 async def get_current_user_expired_ok(request: Request):
     """
     Versão adaptada de get_current_user que permite tokens expirados
     para manter compatibilidade com clientes existentes.
     """
-    auth_header = request.headers.get("Authorization")
-    if not auth_header or not auth_header.startswith("Bearer "):
-        logger.error("Authorization header ausente ou mal formatado")
+    return await _user_from_request(request, allow_expired=True)
+
+async def get_current_admin(current_user: User = Depends(get_current_user)):
+    """Exige que o usuário autenticado esteja em ADMIN_USERNAMES"""
+    if current_user.username not in ADMIN_USERNAMES:
+        logger.warning(f"Acesso administrativo negado para {current_user.username}")
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token não fornecido",
-            headers={"WWW-Authenticate": "Bearer"}
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Acesso restrito a administradores"
         )
-        
-    token = auth_header.replace("Bearer ", "")
-    
-    try:
-        # Primeira tentativa: decodificar com verificação completa usando múltiplas chaves
-        try:
-            payload = verify_token_with_multiple_keys(token)
-            username: str = payload.get("sub")
-        except JWTError as e:
-            logger.error(f"Erro ao verificar token com múltiplas chaves: {str(e)}")
-            raise e
-        
-        if username is None:
-            logger.error("Token não contém 'sub' claim")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED, 
-                detail="Token inválido",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-            
-        token_data = TokenData(username=username, exp=payload.get("exp"))
-        user = await get_user(username=token_data.username)
-        
-        if user is None:
-            logger.error(f"Usuário não encontrado: {token_data.username}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Usuário não encontrado",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-        
-        return user
-    except ExpiredSignatureError:
-        # Token expirado, mas vamos permitir mesmo assim
-        logger.info("Verificando token expirado: " + token[:10] + "...")
-        
-        # Tentamos cada chave possível ignorando a expiração
-        last_error = None
-        payload = None
-        
-        # Tenta a chave principal primeiro
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options={"verify_exp": False})
-            logger.info("Token expirado verificado com chave principal")
-        except JWTError as e:
-            last_error = e
-            logger.warning(f"Falha na verificação com chave principal (ignorando expiração): {str(e)}")
-        
-        # Se falhou, tenta chaves alternativas
-        if not payload:
-            for i, alt_key in enumerate(ALTERNATE_SECRET_KEYS):
-                try:
-                    payload = jwt.decode(token, alt_key, algorithms=[ALGORITHM], options={"verify_exp": False})
-                    logger.info(f"Token expirado verificado com chave alternativa {i+1}")
-                    break
-                except JWTError as e:
-                    logger.warning(f"Falha na verificação com chave alternativa {i+1} (ignorando expiração): {str(e)}")
-        
-        # Se nenhuma chave funcionou
-        if not payload:
-            logger.error(f"Erro decodificando token (ignorando expiração): {last_error}")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
-        
-        username: str = payload.get("sub")
-        if username is None:
-            logger.error("Token expirado não contém 'sub' claim")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
-            
-        user = await get_user(username=username)
-        if user is None:
-            logger.error(f"Usuário não encontrado (token expirado): {username}")
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Usuário não encontrado")
-            
-        return user
-    except JWTError as e:
-        logger.error(f"Erro JWT: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token inválido")
-    except Exception as e:
-        logger.error(f"Erro inesperado em get_current_user_expired_ok: {str(e)}")
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Não autorizado")
+    return current_user
@@ -0,0 +1,114 @@
+"""
+Benchmark de serialização: compara o caminho padrão do FastAPI (validação de
+cada item contra o response_model + jsonable_encoder + json.dumps) com o caminho
+rápido de utils/fast_json.py em uma resposta com muitas corridas.
+
+As duas rotas recebem os mesmos documentos, passam pelo mesmo trip_helper e são
+chamadas pela pilha ASGI completa (httpx.ASGITransport). Executa sem MongoDB.
+
+Uso:
+    python benchmarks/json_serialization.py [--trips 100000] [--rounds 5]
+
+Requer httpx (mesma dependência do TestClient do FastAPI).
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/")
+
+import httpx
+from bson import ObjectId
+from fastapi import FastAPI, Response
+
+from models import Trip
+from routes.trips import trip_helper
+from utils import fast_json
+from utils.fast_json import fast_json_response
+
+
+def build_documents(count: int) -> list:
+    """Documentos no formato em que o Mongo devolve as corridas"""
+    user_id = ObjectId()
+    start = datetime(2024, 1, 1)
+    platforms = ("uber", "99", "indrive")
+    return [
+        {
+            "_id": ObjectId(),
+            "user_id": user_id,
+            "driver_id": f"motorista-{i % 50}",
+            "driver_key": f"motorista-{i % 50}",
+            "platform": platforms[i % len(platforms)],
+            "date": start + timedelta(days=i % 365),
+            "distance": 3.5 + (i % 40),
+            "earnings": 12.75 + (i % 90),
+            "origin": "Centro",
+            "destination": "Aeroporto",
+        }
+        for i in range(count)
+    ]
+
+
+def build_app(documents: list) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/padrao", response_model=list[Trip])
+    async def standard():
+        return [trip_helper(doc) for doc in documents]
+
+    @app.get("/rapido", response_model=list[Trip])
+    async def fast(response: Response):
+        return fast_json_response([trip_helper(doc) for doc in documents], response, model=Trip)
+
+    return app
+
+
+async def measure(client: httpx.AsyncClient, path: str, rounds: int):
+    durations = []
+    body = b""
+    for _ in range(rounds):
+        started = time.perf_counter()
+        response = await client.get(path)
+        body = response.content
+        durations.append(time.perf_counter() - started)
+    return durations, body
+
+
+async def run(trips: int, rounds: int):
+    app = build_app(build_documents(trips))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        # Aquece as duas rotas (compilação dos validadores, caches)
+        await client.get("/padrao")
+        await client.get("/rapido")
+        standard, standard_body = await measure(client, "/padrao", rounds)
+        fast, fast_body = await measure(client, "/rapido", rounds)
+
+    same = json.loads(standard_body) == json.loads(fast_body)
+    encoder = "orjson" if fast_json.orjson is not None else "json (orjson não instalado)"
+
+    print(f"{trips} corridas, {rounds} rodadas, codificador rápido: {encoder}")
+    print(f"{'caminho':<10} {'mediana (ms)':>13} {'mín (ms)':>10} {'bytes':>11}")
+    for name, durations, body in (("padrão", standard, standard_body), ("rápido", fast, fast_body)):
+        print(f"{name:<10} {statistics.median(durations) * 1000:>13.1f} "
+              f"{min(durations) * 1000:>10.1f} {len(body):>11}")
+    print(f"ganho (mediana): {statistics.median(standard) / statistics.median(fast):.1f}x")
+    print(f"conteúdo idêntico: {'sim' if same else 'NÃO'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--trips", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.trips, args.rounds))
+
+
+if __name__ == "__main__":
+    main()
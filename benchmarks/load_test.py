@@ -0,0 +1,227 @@
+"""
+Teste de carga de ponta a ponta: executa a aplicação real (main.app) por um
+cliente ASGI em processo, sobre um MongoDB simulado em memória populado com
+dados realistas, e reproduz a mistura de chamadas do aplicativo (login, listagens
+de viagens/despesas/metas, criação de viagem e geração de relatório).
+
+Mostra vazão e latência p50/p95/p99 por endpoint. Roda offline; as latências
+medem a aplicação e o driver, não um servidor MongoDB real, então servem para
+comparar versões do código entre si.
+
+Uso:
+    python benchmarks/load_test.py [--requests 2000] [--concurrency 20]
+                                   [--drivers 20] [--trips-per-driver 200] [--json]
+
+Requer httpx e mongomock-motor (pip install -r requirements-dev.txt).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/")
+os.environ["ENSURE_INDEXES_ON_STARTUP"] = "false"
+os.environ["BACKFILL_DRIVER_KEYS_ON_STARTUP"] = "false"
+os.environ["LOG_FILE"] = ""
+# A reconstrução dos totais feita na preparação dos dados espera esse tempo duas vezes
+os.environ.setdefault("ROLLUPS_STATE_TTL_SECONDS", "0.5")
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import httpx
+import motor.motor_asyncio
+from mongomock_motor import AsyncMongoMockClient
+
+# O cliente do database.py passa a ser o simulado em memória
+motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+
+import auth
+import database
+import main
+import rollups
+
+USERNAME = "carga"
+PASSWORD = "carga-senha"
+PLATFORMS = ["uber", "99", "indrive"]
+CATEGORIES = ["Combustível", "Manutenção", "Impostos", "Seguro", "Outros"]
+DAYS = 90
+
+# Peso de cada operação na mistura de requisições
+MIX = {
+    "login": 5,
+    "listar viagens": 30,
+    "listar despesas": 20,
+    "listar metas": 10,
+    "criar viagem": 20,
+    "gerar relatório": 15,
+}
+
+
+async def seed(drivers: int, trips_per_driver: int, rng: random.Random) -> list:
+    """Popula usuário, motoristas, viagens, despesas, metas e totais diários"""
+    user_id = (await database.users_collection.insert_one({
+        "username": USERNAME,
+        "email": "carga@example.com",
+        "password": auth.get_password_hash(PASSWORD),
+    })).inserted_id
+    start = datetime.combine(date.today() - timedelta(days=DAYS), datetime.min.time())
+
+    driver_ids = [f"motorista-{i}" for i in range(drivers)]
+    await database.drivers_collection.insert_many([{"name": driver_id} for driver_id in driver_ids])
+    for driver_id in driver_ids:
+        trips = [database.with_driver_key({
+            "user_id": str(user_id),
+            "driver_id": driver_id,
+            "platform": rng.choice(PLATFORMS),
+            "date": start + timedelta(days=rng.randrange(DAYS)),
+            "distance": round(rng.uniform(2, 40), 1),
+            "earnings": round(rng.uniform(8, 90), 2),
+            "origin": "Centro",
+            "destination": "Bairro",
+        }) for _ in range(trips_per_driver)]
+        expenses = [database.with_driver_key({
+            "user_id": str(user_id),
+            "driver_id": driver_id,
+            "category": rng.choice(CATEGORIES),
+            "amount": round(rng.uniform(10, 250), 2),
+            "date": start + timedelta(days=rng.randrange(DAYS)),
+            "description": "despesa",
+        }) for _ in range(trips_per_driver // 5)]
+        goals = [database.with_driver_key({
+            "user_id": str(user_id),
+            "driver_id": driver_id,
+            "name": f"Meta {n}",
+            "target_amount": 5000.0,
+            "current_amount": 0.0,
+            "deadline": start + timedelta(days=DAYS + 30),
+        }) for n in range(3)]
+        await database.trips_collection.insert_many(trips)
+        await database.expenses_collection.insert_many(expenses)
+        await database.goals_collection.insert_many(goals)
+
+    await rollups.rebuild_daily_rollups()
+    return driver_ids
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(total: int, concurrency: int, driver_ids: list, rng: random.Random) -> tuple:
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://carga") as client:
+        response = await client.post("/api/login", json={"username": USERNAME, "password": PASSWORD})
+        headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        period_end = date.today()
+
+        def trip_body():
+            return {
+                "driver_id": rng.choice(driver_ids),
+                "platform": rng.choice(PLATFORMS),
+                "date": (period_end - timedelta(days=rng.randrange(DAYS))).isoformat(),
+                "distance": round(rng.uniform(2, 40), 1),
+                "earnings": round(rng.uniform(8, 90), 2),
+                "origin": "Centro",
+                "destination": "Bairro",
+            }
+
+        def report_body():
+            # Poucos períodos distintos: parte dos relatórios vem do cache
+            days = rng.choice([7, 30, 90])
+            return {
+                "driver_id": rng.choice(driver_ids),
+                "start_date": (period_end - timedelta(days=days)).isoformat(),
+                "end_date": period_end.isoformat(),
+            }
+
+        operations = {
+            "login": lambda: client.post("/api/login", json={"username": USERNAME, "password": PASSWORD}),
+            "listar viagens": lambda: client.get("/api/trips/", params={"driver_id": rng.choice(driver_ids)},
+                                                 headers=headers),
+            "listar despesas": lambda: client.get("/api/expenses", params={"limit": 50}, headers=headers),
+            "listar metas": lambda: client.get("/api/goals/", headers=headers),
+            "criar viagem": lambda: client.post("/api/trips/", json=trip_body(), headers=headers),
+            "gerar relatório": lambda: client.post("/api/reports/", json=report_body(), headers=headers),
+        }
+        plan = rng.choices(list(MIX), weights=list(MIX.values()), k=total)
+
+        latencies = {name: [] for name in MIX}
+        errors = {name: 0 for name in MIX}
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def call(name):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await operations[name]()
+                latencies[name].append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    errors[name] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(call(name) for name in plan))
+        elapsed = time.perf_counter() - start
+
+    return latencies, errors, elapsed
+
+
+def summarize(latencies: dict, errors: dict, elapsed: float) -> dict:
+    endpoints = {}
+    for name, values in latencies.items():
+        if not values:
+            continue
+        endpoints[name] = {
+            "requests": len(values),
+            "errors": errors[name],
+            "per_second": round(len(values) / elapsed, 1),
+            "p50_ms": round(statistics.median(values), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+        }
+    total = sum(len(values) for values in latencies.values())
+    return {"elapsed_s": round(elapsed, 2), "requests_per_second": round(total / elapsed, 1), "endpoints": endpoints}
+
+
+def print_summary(summary: dict, args):
+    print(f"{args.requests} requisições, {args.concurrency} simultâneas, {args.drivers} motoristas, "
+          f"{args.trips_per_driver} viagens por motorista\n")
+    print(f"{'endpoint':<18}{'req':>7}{'erros':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, data in summary["endpoints"].items():
+        print(f"{name:<18}{data['requests']:>7}{data['errors']:>7}{data['per_second']:>9}"
+              f"{data['p50_ms']:>10}{data['p95_ms']:>10}{data['p99_ms']:>10}")
+    print(f"\nTotal: {summary['requests_per_second']} req/s em {summary['elapsed_s']} s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--drivers", type=int, default=20)
+    parser.add_argument("--trips-per-driver", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", action="store_true", help="Imprime o resultado em JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    async def run():
+        driver_ids = await seed(args.drivers, args.trips_per_driver, rng)
+        return await run_load(args.requests, args.concurrency, driver_ids, rng)
+
+    summary = summarize(*asyncio.run(run()))
+    if args.json:
+        print(json.dumps(summary, indent=2, ensure_ascii=False))
+    else:
+        print_summary(summary, args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,134 @@
+"""
+Benchmark de login: mede a vazão de /api/login durante uma rajada de logins e a
+latência de um endpoint leve (/api/debug/cache-stats) disparado em paralelo.
+
+Compara o modo atual (bcrypt no executor dedicado) com o modo antigo, em que o
+bcrypt rodava direto no event loop. Executa sem MongoDB: a coleção de usuários é
+substituída por um usuário em memória.
+
+Uso:
+    python benchmarks/login_storm.py [--logins 200] [--concurrency 50]
+
+Requer httpx (mesma dependência do TestClient do FastAPI).
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/")
+
+import logging
+logging.disable(logging.CRITICAL)
+
+import httpx
+from bson import ObjectId
+
+import auth
+import main
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark-password"
+
+
+class InMemoryUsers:
+    """Substituto mínimo de users_collection para o benchmark"""
+
+    def __init__(self):
+        self.doc = {
+            "_id": ObjectId(),
+            "username": USERNAME,
+            "email": "benchmark@example.com",
+            "password": auth.get_password_hash(PASSWORD),
+        }
+
+    async def find_one(self, query):
+        return self.doc if query.get("username") == USERNAME else None
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_storm(logins: int, concurrency: int):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        semaphore = asyncio.Semaphore(concurrency)
+        probe_latencies = []
+        statuses = {}
+        storm_done = asyncio.Event()
+
+        async def login():
+            async with semaphore:
+                response = await client.post("/api/login", json={"username": USERNAME, "password": PASSWORD})
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        async def probe():
+            while not storm_done.is_set():
+                start = time.perf_counter()
+                await client.get("/api/debug/cache-stats")
+                probe_latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - start
+        storm_done.set()
+        await probe_task
+
+    return {
+        "logins_per_second": statuses.get(200, 0) / elapsed,
+        "statuses": statuses,
+        "probe_requests": len(probe_latencies),
+        "probe_p50_ms": statistics.median(probe_latencies),
+        "probe_p95_ms": percentile(probe_latencies, 95),
+        "probe_max_ms": max(probe_latencies),
+    }
+
+
+async def run_inline(func, *args):
+    """Modo antigo: bcrypt executado diretamente no event loop"""
+    return func(*args)
+
+
+def print_result(label, result):
+    print(f"{label}:")
+    print(f"  logins/s:            {result['logins_per_second']:.1f}")
+    print(f"  status HTTP:         {result['statuses']}")
+    print(f"  requisições sonda:   {result['probe_requests']}")
+    print(f"  sonda p50/p95/max:   {result['probe_p50_ms']:.1f} / {result['probe_p95_ms']:.1f} / {result['probe_max_ms']:.1f} ms")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    auth.users_collection = InMemoryUsers()
+    # Sem cache, cada login consulta a coleção substituta como em produção
+    auth.user_cache.max_entries = 0
+
+    executor_result = asyncio.run(run_storm(args.logins, args.concurrency))
+
+    original = auth.run_password_task
+    auth.run_password_task = run_inline
+    try:
+        inline_result = asyncio.run(run_storm(args.logins, args.concurrency))
+    finally:
+        auth.run_password_task = original
+
+    print(f"{args.logins} logins, {args.concurrency} simultâneos, "
+          f"PASSWORD_HASH_CONCURRENCY={auth.PASSWORD_HASH_CONCURRENCY}\n")
+    print_result("bcrypt no executor dedicado", executor_result)
+    print_result("bcrypt no event loop (modo antigo)", inline_result)
+
+
+if __name__ == "__main__":
+    main_cli()
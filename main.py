@@ -1,41 +1,114 @@
+# Logs configurados antes dos demais módulos, que registram mensagens já na importação
+from utils.logging_setup import setup_logging, shutdown_logging
+setup_logging()
+
 from fastapi import Depends, FastAPI, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.exceptions import RequestValidationError
 from jose import jwt, ExpiredSignatureError, JWTError
 from datetime import datetime, timedelta
 
-from database import users_collection, normalize_driver_ids, merge_driver_ids
+from database import users_collection, claim_normalize_driver_ids, run_normalize_driver_ids, normalize_driver_ids_status, merge_driver_ids, ensure_indexes, backfill_driver_keys
 from models import LoginRequest, User, TokenResponse, UserCreate
-from auth import authenticate_user, create_access_token, create_refresh_token, get_user, get_password_hash, get_current_user, renew_access_token
-from routes import drivers, trips, expenses, goals, reports
+from auth import authenticate_user, create_access_token, create_refresh_token, get_user, get_password_hash_async, get_current_user, renew_access_token
+from routes import drivers, trips, expenses, goals, reports, analytics
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware import Middleware
 from starlette.middleware.trustedhost import TrustedHostMiddleware
+from contextlib import asynccontextmanager
+import asyncio
 import logging
-from auth import SECRET_KEY, ALGORITHM, ALTERNATE_SECRET_KEYS, verify_token_with_multiple_keys
+import os
+import time
+from auth import SECRET_KEY, ALGORITHM, ALTERNATE_SECRET_KEYS, verify_token_with_multiple_keys, token_cache
+from auth import key_registry, rotate_signing_key, retire_signing_key, user_cache, invalidate_user_cache
+from auth import get_current_admin, load_signing_keys, authenticate_request_with_key_reload, SIGNING_KEYS_SYNC_SECONDS
+from rollups import rebuild_daily_rollups, ensure_daily_rollups, rebuild_status
 import traceback
 from models import UserUpdate
 from bson import ObjectId
+from pymongo import ReturnDocument
+from utils.metrics import http_request_duration, http_requests_in_flight, render_metrics
+from utils.metrics import RequestDbStats, current_db_stats, http_request_db_commands, http_request_db_duration
 
-# Configurar logger para depuração
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 # Log da chave secreta sendo utilizada (apenas primeiros caracteres para segurança)
 logger.info(f"Aplicação principal usando chave secreta (primeiros 10 caracteres): {SECRET_KEY[:10]}...")
 
-# Configuração de manipulador de logs para arquivo
-file_handler = logging.FileHandler('api.log')
-file_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+# Cria os índices ausentes na inicialização (desative com ENSURE_INDEXES_ON_STARTUP=false)
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+# Preenche driver_key em documentos antigos, em segundo plano, na inicialização
+BACKFILL_DRIVER_KEYS_ON_STARTUP = os.getenv("BACKFILL_DRIVER_KEYS_ON_STARTUP", "true").lower() == "true"
+# Constrói os totais diários (rollups.py) na inicialização, se ainda não foram construídos
+BACKFILL_ROLLUPS_ON_STARTUP = os.getenv("BACKFILL_ROLLUPS_ON_STARTUP", "true").lower() == "true"
+
+async def _startup_backfill_task():
+    if BACKFILL_DRIVER_KEYS_ON_STARTUP:
+        try:
+            await backfill_driver_keys()
+        except Exception as e:
+            logger.error(f"Erro ao preencher driver_key: {str(e)}")
+    # Depende de driver_key preenchido; até terminar, os relatórios somam os dados brutos
+    if BACKFILL_ROLLUPS_ON_STARTUP:
+        try:
+            await ensure_daily_rollups()
+        except Exception as e:
+            logger.error(f"Erro ao construir os totais diários: {str(e)}")
+
+async def _sync_signing_keys_task():
+    """Recarrega periodicamente as chaves rotacionadas ou removidas por outros workers"""
+    while True:
+        await asyncio.sleep(SIGNING_KEYS_SYNC_SECONDS)
+        try:
+            await load_signing_keys()
+        except Exception as e:
+            logger.error(f"Erro ao sincronizar chaves de assinatura: {str(e)}")
+
+# Tempo máximo de espera, no encerramento, pelas tarefas em segundo plano canceladas
+SHUTDOWN_TASK_TIMEOUT_SECONDS = float(os.getenv("SHUTDOWN_TASK_TIMEOUT_SECONDS", "10"))
+
+async def _cancel_and_wait(*tasks):
+    """Cancela as tarefas ainda em execução e aguarda que terminem (até SHUTDOWN_TASK_TIMEOUT_SECONDS)"""
+    pending = [task for task in tasks if task and not task.done()]
+    for task in pending:
+        task.cancel()
+    if pending:
+        _, still_running = await asyncio.wait(pending, timeout=SHUTDOWN_TASK_TIMEOUT_SECONDS)
+        if still_running:
+            logger.warning(f"{len(still_running)} tarefa(s) em segundo plano não terminaram no encerramento")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Etapas de inicialização e encerramento da aplicação"""
+    if ENSURE_INDEXES_ON_STARTUP:
+        try:
+            report = await ensure_indexes()
+            created = sum(len(item["created"]) for item in report.values())
+            drift = sum(len(item["drift"]) + len(item["missing"]) for item in report.values())
+            logger.info(f"Verificação de índices concluída: {created} criados, {drift} divergências")
+        except Exception as e:
+            # Sem acesso ao banco na inicialização: a API sobe mesmo assim
+            logger.error(f"Erro ao verificar índices na inicialização: {str(e)}")
+    try:
+        await load_signing_keys()
+    except Exception as e:
+        logger.error(f"Erro ao carregar chaves de assinatura: {str(e)}")
+    keys_task = asyncio.create_task(_sync_signing_keys_task())
+    backfill_task = None
+    if BACKFILL_DRIVER_KEYS_ON_STARTUP or BACKFILL_ROLLUPS_ON_STARTUP:
+        backfill_task = asyncio.create_task(_startup_backfill_task())
+    yield
+    # Uma normalização (ou reconstrução de totais) interrompida fica registrada e pode
+    # ser retomada: as tarefas são aguardadas para que gravem o estado antes do fim
+    await _cancel_and_wait(keys_task, backfill_task, _normalize_task, _rollups_task)
+    shutdown_logging()
 
 # Configuração atualizada do CORS para garantir que os cabeçalhos estejam presentes mesmo em erros
 app = FastAPI(middleware=[
         Middleware(TrustedHostMiddleware, allowed_hosts=["*"])
-    ])
+    ], lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,7 +116,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["X-Token-Expired", "WWW-Authenticate"]  # Expor cabeçalhos personalizados
+    expose_headers=["X-Token-Expired", "WWW-Authenticate", "X-Next-Page-Token", "Server-Timing"]  # Expor cabeçalhos personalizados
 )
 
 # Middleware para verificar tokens antes de processar a requisição
@@ -58,48 +131,28 @@ async def token_verification_middleware(request: Request, call_next):
     if request.url.path in ["/api/login", "/api/register", "/api/refresh-token"]:
         return await call_next(request)
 
+    start = time.perf_counter()
 
-    logger.info(f"Recebida requisição: {request.method} {request.url}")
-    logger.info(f"Headers da requisição: {request.headers}")
-
-    auth_header = request.headers.get("Authorization")
-    if auth_header and auth_header.startswith("Bearer "):
-        logger.info(f"Authorization header presente: {auth_header[:15]}...")
-        token = auth_header.replace("Bearer ", "")
-
-        try:
-            # Tentar validação com múltiplas chaves, ignorando expiração para diagnóstico
-            for i, key in enumerate([SECRET_KEY] + ALTERNATE_SECRET_KEYS):
-                try:
-                    # Decodificar o token sem verificar expiração para depuração
-                    payload = jwt.decode(token, key, algorithms=[ALGORITHM], options={"verify_exp": False})
-                    key_info = "principal" if i == 0 else f"alternativa {i}"
-                    logger.info(f"Token decodificado com sucesso usando chave {key_info}: {payload}")
-                    
-                    # Tentar verificar com expiração usando a mesma chave que funcionou
-                    try:
-                        jwt.decode(token, key, algorithms=[ALGORITHM])
-                        logger.info(f"Token válido e não expirado (usando chave {key_info})")
-                        # Token válido, não precisamos verificar mais chaves
-                        break
-                    except ExpiredSignatureError:
-                        logger.warning(f"Token expirado (chave {key_info}).")
-                        request.state.token_expired = True
-                        # Token expirado, mas decodificável, não precisamos verificar mais chaves
-                        break
-                except JWTError as e:
-                    if i == len(ALTERNATE_SECRET_KEYS):
-                        # Se foi a última chave e ainda falhou
-                        logger.error(f"Erro ao verificar token JWT com todas as chaves: {str(e)}")
-                    # Senão, continua testando outras chaves
-                    continue
-        except Exception as e:
-            logger.error(f"Erro inesperado ao processar token: {str(e)}")
-    else:
-        logger.warning("Authorization header ausente ou inválido.")
+    # Decodifica o token uma única vez; dependências e rotas leem o resultado de request.state
+    payload = await authenticate_request_with_key_reload(request)
+    if request.state.token is None:
+        logger.debug("Authorization header ausente ou inválido.")
+    elif payload is None:
+        logger.warning("Erro ao verificar token JWT com todas as chaves: %s", request.state.token_error)
+    elif request.state.token_expired:
+        logger.debug("Token expirado (chave %s).", request.state.token_key)
 
     response = await call_next(request)
 
+    # Uma linha estruturada por requisição, amostrada (LOG_REQUEST_SAMPLE_RATE)
+    logger.info("Requisição concluída", extra={
+        "sample": True,
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+    })
+
     if response.status_code == 401 and getattr(request.state, "token_expired", False):
         return JSONResponse(
             status_code=401,
@@ -112,6 +165,37 @@ async def token_verification_middleware(request: Request, call_next):
 
     return response
 
+# Métricas por rota: registrado por último, envolve todos os demais middlewares.
+# Também conta os comandos do MongoDB da requisição e os informa no cabeçalho Server-Timing.
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    http_requests_in_flight.inc()
+    db_stats = RequestDbStats()
+    context_token = current_db_stats.set(db_stats)
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        elapsed = time.perf_counter() - start
+        response.headers["Server-Timing"] = f"{db_stats.server_timing()}, total;dur={elapsed * 1000:.2f}"
+        response.headers["Timing-Allow-Origin"] = "*"
+        return response
+    finally:
+        current_db_stats.reset(context_token)
+        http_requests_in_flight.dec()
+        # Rota declarada (ex.: /api/trips/{trip_id}), não a URL, para limitar as séries
+        route = getattr(request.scope.get("route"), "path", "não encontrada")
+        http_request_duration.observe(time.perf_counter() - start, method=request.method,
+                                      route=route, status=status_code)
+        http_request_db_commands.observe(db_stats.commands, method=request.method, route=route)
+        http_request_db_duration.observe(db_stats.seconds, method=request.method, route=route)
+
+# Métricas no formato do Prometheus
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # Registrar rotas
 app.include_router(drivers.router, prefix="/api/me", tags=["me"])
 app.include_router(drivers.router, prefix="/api/drivers", tags=["drivers"])
@@ -119,6 +203,7 @@ app.include_router(trips.router, prefix="/api/trips", tags=["trips"])
 app.include_router(expenses.router, prefix="/api/expenses", tags=["expenses"])
 app.include_router(goals.router, prefix="/api/goals", tags=["goals"])
 app.include_router(reports.router, prefix="/api/reports", tags=["reports"])
+app.include_router(analytics.router, prefix="/api/analytics", tags=["analytics"])
 
 # Endpoint para login
 @app.post("/api/login", response_model=TokenResponse)
@@ -162,35 +247,28 @@ async def refresh_token_endpoint(request: Request):
         
     refresh_token = auth_header.replace("Bearer ", "")
     try:
-        # Tenta verificar o token de atualização com múltiplas chaves
-        for key in [SECRET_KEY] + ALTERNATE_SECRET_KEYS:
-            try:
-                payload = jwt.decode(refresh_token, key, algorithms=[ALGORITHM])
-                username = payload.get("sub")
-                
-                if not username:
-                    continue
-                
-                # Token válido, gerar novo token de acesso
-                access_token = create_access_token(data={"sub": username})
-                logger.info(f"Token renovado com sucesso para: {username}")
-                return {"access_token": access_token, "token_type": "bearer"}
-            except JWTError:
-                continue
-        
-        # Se chegou aqui, nenhuma chave funcionou
+        # Verifica o token de atualização pelo "kid" (ou chaves legadas, se ausente)
+        payload = verify_token_with_multiple_keys(refresh_token)
+    except JWTError:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token de atualização inválido",
             headers={"WWW-Authenticate": "Bearer"}
         )
-    except Exception as e:
-        logger.error(f"Erro ao renovar token: {str(e)}")
+
+    username = payload.get("sub")
+    if not username:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Erro ao processar solicitação de renovação de token"
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token de atualização inválido",
+            headers={"WWW-Authenticate": "Bearer"}
         )
 
+    # Token válido, gerar novo token de acesso
+    access_token = create_access_token(data={"sub": username})
+    logger.info(f"Token renovado com sucesso para: {username}")
+    return {"access_token": access_token, "token_type": "bearer"}
+
 # Endpoint para criar um novo usuário
 @app.post("/api/register", response_model=User)
 async def create_user(user: UserCreate):
@@ -201,21 +279,21 @@ async def create_user(user: UserCreate):
         raise HTTPException(status_code=400, detail="Nome de usuário já está em uso")
     
     # Criar hash da senha
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash_async(user.password)
     user_dict = user.dict()
     user_dict["password"] = hashed_password
     
     # Inserir novo usuário
-    result = await users_collection.insert_one(user_dict)
-    
-    # Recuperar o usuário criado
-    created_user = await users_collection.find_one({"_id": result.inserted_id})
+    # insert_one preenche o _id no próprio documento: não é preciso relê-lo
+    await users_collection.insert_one(user_dict)
+    invalidate_user_cache(user.username)
     
     logger.info(f"Novo usuário criado: {user.username}")
     return User(
-        id=str(created_user["_id"]),
-        username=created_user["username"],
-        password=created_user["password"]  # A senha já está com hash
+        id=str(user_dict["_id"]),
+        username=user_dict["username"],
+        email=user_dict.get("email") or None,
+        password=user_dict["password"]  # A senha já está com hash
     )
 
 # Endpoint para verificar a autenticação do usuário atual
@@ -223,12 +301,35 @@ async def create_user(user: UserCreate):
 async def get_me(current_user: User = Depends(get_current_user)):
     return current_user
 
-# Endpoint para normalizar IDs de motoristas no banco de dados
-@app.post("/api/admin/normalize-driver-ids")
-async def normalize_driver_ids_endpoint(current_user: User = Depends(get_current_user)):
+# Normalização de IDs de motoristas, executada em segundo plano
+_normalize_task = None
+
+async def _normalize_driver_ids_task(previous: dict):
+    try:
+        await run_normalize_driver_ids(previous)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na normalização de driver_ids: {str(e)}", exc_info=True)
+
+@app.post("/api/admin/normalize-driver-ids", status_code=202)
+async def normalize_driver_ids_endpoint(restart: bool = False, current_user: User = Depends(get_current_user)):
+    """
+    Inicia a normalização em segundo plano (ou retoma a última execução interrompida;
+    restart=true começa do zero). O andamento é consultado em /status.
+    """
     # Aqui poderíamos adicionar uma verificação se o usuário é um administrador
-    result = await normalize_driver_ids()
-    return result
+    global _normalize_task
+    # A marcação em job_checkpoints é atômica: vale também entre processos
+    previous = await claim_normalize_driver_ids(restart)
+    if previous is None:
+        raise HTTPException(status_code=409, detail="Normalização já em andamento")
+    _normalize_task = asyncio.create_task(_normalize_driver_ids_task(previous))
+    return await normalize_driver_ids_status()
+
+@app.get("/api/admin/normalize-driver-ids/status")
+async def normalize_driver_ids_status_endpoint(current_user: User = Depends(get_current_user)):
+    return await normalize_driver_ids_status()
 
 # Endpoint para mesclar IDs de motoristas
 @app.post("/api/admin/merge-driver-ids")
@@ -239,8 +340,68 @@ async def merge_driver_ids_endpoint(data: dict, current_user: User = Depends(get
     
     # Chamar a função para mesclar IDs
     result = await merge_driver_ids(data["source_id"], data["target_id"])
+    if "error" not in result:
+        # Os totais diários dos dois motoristas mudam de chave com a mesclagem
+        for driver_id in (data["source_id"], data["target_id"]):
+            await rebuild_daily_rollups(str(driver_id).strip())
     return result
 
+# Reconstrução dos totais diários (todos os motoristas ou apenas um), em segundo plano
+_rollups_task = None
+
+async def _rebuild_rollups_task(driver_id: str = None):
+    try:
+        await rebuild_daily_rollups(driver_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na reconstrução dos totais diários: {str(e)}", exc_info=True)
+
+@app.post("/api/admin/rollups/rebuild", status_code=202)
+async def rebuild_rollups_endpoint(driver_id: str = None, current_user: User = Depends(get_current_admin)):
+    """
+    Inicia a reconstrução em segundo plano. A completa roda em um processo por vez
+    (as demais solicitações não fazem nada); o andamento é consultado em /status.
+    """
+    global _rollups_task
+    if _rollups_task and not _rollups_task.done():
+        raise HTTPException(status_code=409, detail="Reconstrução já em andamento")
+    _rollups_task = asyncio.create_task(_rebuild_rollups_task(driver_id))
+    # Deixa a tarefa registrar a reconstrução completa antes de responder
+    await asyncio.sleep(0)
+    return await rebuild_status()
+
+@app.get("/api/admin/rollups/rebuild/status")
+async def rebuild_rollups_status_endpoint(current_user: User = Depends(get_current_admin)):
+    return await rebuild_status()
+
+# Endpoint para verificar (e opcionalmente criar) os índices declarados em database.py
+@app.get("/api/admin/indexes")
+async def indexes_endpoint(build: bool = False, current_user: User = Depends(get_current_admin)):
+    return await ensure_indexes(build=build)
+
+# Endpoints para rotação de chaves de assinatura JWT em tempo de execução.
+# Restritos a ADMIN_USERNAMES; as chaves são sempre geradas no servidor.
+@app.get("/api/admin/signing-keys")
+async def list_signing_keys(current_user: User = Depends(get_current_admin)):
+    await load_signing_keys()
+    return {"keys": key_registry.describe()}
+
+@app.post("/api/admin/signing-keys/rotate")
+async def rotate_signing_key_endpoint(current_user: User = Depends(get_current_admin)):
+    kid = await rotate_signing_key()
+    return {"active_kid": kid, "keys": key_registry.describe()}
+
+@app.delete("/api/admin/signing-keys/{kid}")
+async def retire_signing_key_endpoint(kid: str, current_user: User = Depends(get_current_admin)):
+    try:
+        removed = await retire_signing_key(kid)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not removed:
+        raise HTTPException(status_code=404, detail="Chave não encontrada")
+    return {"keys": key_registry.describe()}
+
 # Adicionar um endpoint para debug da chave secreta
 @app.get("/api/debug/token-info", include_in_schema=False)
 async def debug_token_info(request: Request):
@@ -298,12 +459,27 @@ async def debug_token_info(request: Request):
                 "error": str(e)
             })
     
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except JWTError:
+        kid = None
+
     return {
         "token_preview": token[:10] + "...",
+        "kid": kid,
         "results": results,
+        "token_cache": token_cache.stats(),
         "current_time": datetime.utcnow().timestamp()
     }
 
+@app.get("/api/debug/cache-stats", include_in_schema=False)
+async def debug_cache_stats():
+    """Taxa de acerto dos caches em memória (tokens verificados e usuários)"""
+    return {
+        "token_cache": token_cache.stats(),
+        "user_cache": user_cache.stats()
+    }
+
 # No arquivo main.py, adicione:
 
 @app.get("/api/users/me", response_model=User)
@@ -333,23 +509,26 @@ async def update_user_profile(
         if "password" in update_data:
             del update_data["password"]
 
-        result = await users_collection.update_one(
+        updated_user = await users_collection.find_one_and_update(
             {"_id": ObjectId(current_user.id)},
-            {"$set": update_data}
+            {"$set": update_data},
+            return_document=ReturnDocument.AFTER
         )
 
-        if result.modified_count == 0:
+        if updated_user is None:
             raise HTTPException(status_code=404, detail="Usuário não encontrado")
 
-        updated_user = await users_collection.find_one(
-            {"_id": ObjectId(current_user.id)}
-        )
+        # O username pode ter mudado: remove a entrada antiga e a nova do cache
+        invalidate_user_cache(current_user.username, update_data.get("username", current_user.username))
+
         return User(
             id=str(updated_user["_id"]),
             username=updated_user["username"],
-            email=updated_user.get("email", ""),
+            email=updated_user.get("email") or None,
             profile_picture=updated_user.get("profile_picture", "")
         )
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
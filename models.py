@@ -1,5 +1,5 @@
 from bson import ObjectId
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from datetime import datetime, date
 from enum import Enum
 from typing import Optional, List, Dict, Any, Union
@@ -34,8 +34,10 @@ class User(BaseModel):
     """Modelo completo do usuário com todos os campos"""
     id: str
     username: str
-    email: EmailStr
+    email: EmailStr | None = None
     profile_picture: str | None = None
+    # Hash da senha, usado apenas internamente na autenticação (nunca serializado)
+    password: str | None = Field(default=None, exclude=True)
     created_at: datetime | None = None
     updated_at: datetime | None = None
 
@@ -169,3 +171,18 @@ class ReportCreate(ReportBase):
 class Report(ReportBase):
     id: str
 
+class ReportBatchRequest(BaseModel):
+    """Relatórios de vários motoristas para o mesmo período"""
+    driver_ids: List[str] = Field(..., min_length=1)
+    start_date: date
+    end_date: date
+
+
+class BulkItemError(BaseModel):
+    index: int  # Posição do item no lote enviado
+    error: str
+
+class BulkInsertResult(BaseModel):
+    """Resultado de uma inserção em lote: ids inseridos e erros por item"""
+    inserted_ids: List[str]
+    errors: List[BulkItemError] = []
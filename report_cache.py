@@ -0,0 +1,126 @@
+"""
+Cache de relatórios sobre a própria coleção de relatórios.
+
+Um relatório gerado fica salvo com a chave (driver_key, period_start, period_end)
+e é devolvido em novas solicitações idênticas, sem recalcular nem inserir outro
+documento. Alterações em viagens ou despesas de um motorista marcam como
+desatualizados (stale) os relatórios cujo período contém o dia alterado;
+alterações em metas marcam todos os relatórios do motorista. Um relatório
+desatualizado é recalculado e regravado no mesmo documento na próxima solicitação.
+
+Só valem como cache os relatórios gravados com a REPORT_CACHE_VERSION atual:
+relatórios antigos (anteriores ao cache, possivelmente duplicados ou calculados
+antes de viagens inseridas depois) são recalculados na primeira solicitação.
+Incrementar a versão invalida todos os relatórios de uma vez.
+
+Cada invalidação também incrementa a geração do motorista (report_generations).
+Quem gera um relatório lê a geração antes de somar os totais e, depois de gravar,
+confere se ela mudou: se mudou, uma escrita concorrente pode não estar nos totais
+e o relatório gravado é marcado como desatualizado.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from pymongo import UpdateOne
+
+from database import reports_collection, report_generations_collection, driver_key, driver_filter
+
+logger = logging.getLogger(__name__)
+
+REPORT_CACHE_VERSION = 1
+# Geração incrementada quando todos os relatórios são invalidados de uma vez
+ALL_DRIVERS_GENERATION = "*"
+
+
+def report_key(driver_id: str, period_start: datetime, period_end: datetime) -> dict:
+    """Filtro que identifica o relatório de um motorista em um período"""
+    return {**driver_filter(driver_id), "period_start": period_start, "period_end": period_end}
+
+
+def is_cached_report(report: dict) -> bool:
+    """Relatório gravado pelo cache atual e não marcado como desatualizado"""
+    return report.get("cache_version") == REPORT_CACHE_VERSION and not report.get("stale")
+
+
+async def find_cached_report(driver_id: str, period_start: datetime, period_end: datetime):
+    """Relatório já gerado e ainda válido para o motorista e período, se houver"""
+    return await reports_collection.find_one({**report_key(driver_id, period_start, period_end),
+                                              "cache_version": REPORT_CACHE_VERSION,
+                                              "stale": {"$ne": True}})
+
+
+async def read_generations(keys: Iterable[str]) -> dict:
+    """Geração atual de cada driver_key (e a geração global), para comparação após a gravação"""
+    ids = list(set(keys)) + [ALL_DRIVERS_GENERATION]
+    docs = await report_generations_collection.find({"_id": {"$in": ids}}).to_list(length=None)
+    found = {doc["_id"]: doc.get("generation", 0) for doc in docs}
+    return {key: found.get(key, 0) for key in ids}
+
+
+async def mark_stale_if_invalidated(report_ids: dict, generations: dict):
+    """
+    Marca como desatualizados os relatórios recém-gravados ({driver_key: _id}) cujo
+    motorista foi invalidado desde a leitura de `generations`.
+    """
+    current = await read_generations(report_ids)
+    if current[ALL_DRIVERS_GENERATION] != generations.get(ALL_DRIVERS_GENERATION, 0):
+        changed = list(report_ids.values())
+    else:
+        changed = [report_id for key, report_id in report_ids.items()
+                   if current[key] != generations.get(key, 0)]
+    if changed:
+        await reports_collection.update_many({"_id": {"$in": changed}}, {"$set": {"stale": True}})
+        logger.info(f"{len(changed)} relatório(s) gravado(s) como desatualizado(s): dados alterados durante o cálculo")
+
+
+async def _bump_generations(keys: Iterable[str]):
+    """Incrementa a geração antes de marcar os relatórios (ver mark_stale_if_invalidated)"""
+    keys = list(set(keys))
+    if keys:
+        await report_generations_collection.bulk_write([
+            UpdateOne({"_id": key}, {"$inc": {"generation": 1}}, upsert=True) for key in keys
+        ], ordered=False)
+
+
+async def invalidate_reports(driver_days: Iterable[tuple]):
+    """
+    Marca como desatualizados os relatórios que incluem algum dos pares
+    (driver_key, dia) informados. Por motorista, usa o intervalo entre o
+    primeiro e o último dia alterado.
+    """
+    ranges = {}
+    for key, day in driver_days:
+        first, last = ranges.get(key, (day, day))
+        ranges[key] = (min(first, day), max(last, day))
+    if not ranges:
+        return
+
+    query = {"$or": [
+        {"driver_key": key, "period_start": {"$lt": last + timedelta(days=1)}, "period_end": {"$gte": first}}
+        for key, (first, last) in ranges.items()
+    ], "stale": {"$ne": True}}
+    try:
+        await _bump_generations(ranges)
+        await reports_collection.update_many(query, {"$set": {"stale": True}})
+    except Exception as e:
+        logger.error(f"Erro ao invalidar relatórios em cache: {str(e)}")
+
+
+async def invalidate_driver_reports(*driver_ids: str):
+    """Marca como desatualizados todos os relatórios dos motoristas informados"""
+    keys = list({driver_key(driver_id) for driver_id in driver_ids if driver_id is not None})
+    if not keys:
+        return
+    try:
+        await _bump_generations(keys)
+        await reports_collection.update_many({"driver_key": {"$in": keys}, "stale": {"$ne": True}},
+                                             {"$set": {"stale": True}})
+    except Exception as e:
+        logger.error(f"Erro ao invalidar relatórios em cache: {str(e)}")
+
+
+async def invalidate_all_reports():
+    """Marca como desatualizados todos os relatórios (ex.: após reconstruir os totais diários)"""
+    await _bump_generations([ALL_DRIVERS_GENERATION])
+    await reports_collection.update_many({"stale": {"$ne": True}}, {"$set": {"stale": True}})
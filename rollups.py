@@ -0,0 +1,442 @@
+"""
+Totais diários por motorista (driver_daily_rollups).
+
+Cada documento guarda, para um driver_key e um dia, os ganhos, a distância e o
+número de viagens, além do total de despesas por categoria. As rotas de viagens e
+despesas aplicam incrementos a cada criação, alteração ou exclusão, de modo que
+relatórios leiam no máximo um documento por dia do período, independentemente do
+volume de viagens. rebuild_daily_rollups recalcula tudo a partir dos dados brutos.
+
+A reconstrução completa grava sua situação em job_checkpoints (ROLLUPS_JOB_ID) e
+não mexe na coleção em uso: monta os totais numa coleção separada e a troca pela
+principal ao final. Enquanto ela roda, as escritas continuam incrementando a
+coleção principal e também registram os dias alterados, que são recalculados a
+partir dos dados brutos depois da troca. Enquanto não houver uma reconstrução
+concluída (por exemplo, logo após a implantação) ou houver uma em andamento, os
+relatórios somam as viagens e despesas brutas. A situação é relida a cada
+ROLLUPS_STATE_TTL_SECONDS por processo. A aplicação dispara a reconstrução na
+inicialização (ensure_daily_rollups) quando ela ainda não foi feita.
+
+Uso (reconstrução completa ou de um motorista):
+    python rollups.py rebuild [driver_id]
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+from pymongo import ASCENDING, DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from database import (
+    daily_rollups_collection,
+    daily_rollups_staging_collection,
+    rollup_dirty_days_collection,
+    job_checkpoints_collection,
+    trips_collection,
+    expenses_collection,
+    driver_key,
+    driver_filter,
+    backfill_driver_keys,
+)
+from report_cache import invalidate_reports, invalidate_driver_reports, invalidate_all_reports
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_WRITE_BATCH_SIZE = 1000
+
+ROLLUPS_JOB_ID = "daily_rollups"
+# Uma reconstrução "running" mais antiga que isso é considerada abandonada (worker encerrado)
+ROLLUPS_REBUILD_LOCK_SECONDS = int(os.getenv("ROLLUPS_REBUILD_LOCK_SECONDS", "3600"))
+
+# Validade, por processo, da situação lida de job_checkpoints. A reconstrução espera esse
+# tempo depois de se registrar, para que todos os processos passem a registrar os dias alterados
+ROLLUPS_STATE_TTL_SECONDS = float(os.getenv("ROLLUPS_STATE_TTL_SECONDS", "5"))
+_rollups_state = {"doc": None, "read_at": None}
+
+
+def rollup_day(value) -> datetime:
+    """Dia (meia-noite) ao qual um documento pertence"""
+    return datetime(value.year, value.month, value.day)
+
+
+def _rollup_id(doc: dict) -> tuple:
+    key = doc.get("driver_key") or driver_key(doc["driver_id"])
+    return key, rollup_day(doc["date"])
+
+
+def _category(category) -> str:
+    return getattr(category, "value", category) or "Outros"
+
+
+async def _apply_increments(increments: dict):
+    """Grava os incrementos acumulados por (driver_key, dia), criando os documentos ausentes,
+    e invalida os relatórios em cache afetados"""
+    changed = {rollup_id: inc for rollup_id, inc in increments.items() if any(inc.values())}
+    if changed:
+        await daily_rollups_collection.bulk_write([
+            UpdateOne({"driver_key": key, "day": day}, {"$inc": inc}, upsert=True)
+            for (key, day), inc in changed.items()
+        ], ordered=False)
+        # Durante uma reconstrução completa, os dias alterados são recalculados ao final
+        if await _rebuild_running():
+            await _mark_dirty_days(changed.keys())
+        # Relatórios que incluem os dias alterados deixam de valer
+        await invalidate_reports(changed.keys())
+
+
+async def _mark_dirty_days(days: Iterable[tuple]):
+    await rollup_dirty_days_collection.bulk_write([
+        UpdateOne({"_id": f"{key}|{day.isoformat()}"}, {"$set": {"driver_key": key, "day": day}}, upsert=True)
+        for key, day in days
+    ], ordered=False)
+
+
+def _accumulate(increments: dict, rollup_id: tuple, values: dict):
+    inc = increments.setdefault(rollup_id, {})
+    for field, value in values.items():
+        inc[field] = inc.get(field, 0) + value
+
+
+async def apply_trip_rollups(added: Iterable[dict] = (), removed: Iterable[dict] = ()):
+    """Atualiza os totais diários para viagens criadas (added) e removidas (removed).
+    Uma alteração é a remoção da versão antiga mais a inclusão da nova."""
+    try:
+        # Documentos antigos sem data válida também não podem derrubar a requisição
+        increments = {}
+        for sign, trips in ((1, added), (-1, removed)):
+            for trip in trips:
+                _accumulate(increments, _rollup_id(trip), {
+                    "earnings": sign * float(trip.get("earnings") or 0),
+                    "distance": sign * float(trip.get("distance") or 0),
+                    "trip_count": sign,
+                })
+        await _apply_increments(increments)
+    except Exception as e:
+        # A gravação principal já ocorreu; os totais podem ser refeitos com rebuild_daily_rollups
+        logger.error(f"Erro ao atualizar totais diários de viagens: {str(e)}")
+
+
+async def apply_expense_rollups(added: Iterable[dict] = (), removed: Iterable[dict] = ()):
+    """Atualiza os totais diários para despesas criadas (added) e removidas (removed)"""
+    try:
+        increments = {}
+        for sign, expenses in ((1, added), (-1, removed)):
+            for expense in expenses:
+                amount = sign * float(expense.get("amount") or 0)
+                _accumulate(increments, _rollup_id(expense), {
+                    "expenses_total": amount,
+                    "expense_count": sign,
+                    f"expenses_by_category.{_category(expense.get('category'))}": amount,
+                })
+        await _apply_increments(increments)
+    except Exception as e:
+        logger.error(f"Erro ao atualizar totais diários de despesas: {str(e)}")
+
+
+EMPTY_TOTALS = {"earnings": 0.0, "distance": 0.0, "trip_count": 0, "expenses": 0.0, "expense_count": 0}
+
+
+async def _read_state(refresh: bool = False) -> dict:
+    """Situação da reconstrução completa, relida no máximo a cada ROLLUPS_STATE_TTL_SECONDS"""
+    now = asyncio.get_running_loop().time()
+    read_at = _rollups_state["read_at"]
+    if refresh or read_at is None or now - read_at >= ROLLUPS_STATE_TTL_SECONDS:
+        _rollups_state["doc"] = await job_checkpoints_collection.find_one(
+            {"_id": ROLLUPS_JOB_ID}, {"status": 1, "built_at": 1}) or {}
+        _rollups_state["read_at"] = now
+    return _rollups_state["doc"]
+
+
+async def _rebuild_running() -> bool:
+    return (await _read_state()).get("status") == "running"
+
+
+async def rollups_ready() -> bool:
+    """True se os totais diários já foram construídos e nenhuma reconstrução completa está em andamento"""
+    state = await _read_state()
+    return bool(state.get("built_at")) and state.get("status") != "running"
+
+
+async def _raw_period_totals(keys: list, start: datetime, end: datetime) -> dict:
+    """Mesmos totais de drivers_period_totals, calculados sobre viagens e despesas brutas"""
+    match = {"driver_key": {"$in": keys},
+             "date": {"$gte": rollup_day(start), "$lt": rollup_day(end) + timedelta(days=1)}}
+    trips, expenses = await asyncio.gather(
+        trips_collection.aggregate([
+            {"$match": match},
+            {"$group": {
+                "_id": "$driver_key",
+                "earnings": {"$sum": "$earnings"},
+                "distance": {"$sum": "$distance"},
+                "trip_count": {"$sum": 1},
+            }},
+        ]).to_list(length=None),
+        expenses_collection.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$driver_key", "expenses": {"$sum": "$amount"}, "expense_count": {"$sum": 1}}},
+        ]).to_list(length=None),
+    )
+    totals = {}
+    for row in trips + expenses:
+        totals.setdefault(row.pop("_id"), dict(EMPTY_TOTALS)).update(row)
+    return totals
+
+
+async def drivers_period_totals(driver_ids: Iterable[str], start: datetime, end: datetime) -> dict:
+    """
+    Soma os totais diários de vários motoristas entre os dias de start e end
+    (inclusive) numa única agregação. Retorna {driver_key: totais}; motoristas
+    sem movimento no período ficam de fora. Antes da primeira reconstrução
+    completa, soma os dados brutos.
+    """
+    keys = list({driver_key(driver_id) for driver_id in driver_ids})
+    if not await rollups_ready():
+        return await _raw_period_totals(keys, start, end)
+    totals = await daily_rollups_collection.aggregate([
+        {"$match": {"driver_key": {"$in": keys}, "day": {"$gte": rollup_day(start), "$lte": rollup_day(end)}}},
+        {"$group": {
+            "_id": "$driver_key",
+            "earnings": {"$sum": "$earnings"},
+            "distance": {"$sum": "$distance"},
+            "trip_count": {"$sum": "$trip_count"},
+            "expenses": {"$sum": "$expenses_total"},
+            "expense_count": {"$sum": "$expense_count"},
+        }},
+    ]).to_list(length=None)
+    return {item.pop("_id"): item for item in totals}
+
+
+async def driver_period_totals(driver_id: str, start: datetime, end: datetime) -> dict:
+    """Soma os totais diários de um motorista entre os dias de start e end (inclusive)"""
+    totals = await drivers_period_totals([driver_id], start, end)
+    return totals.get(driver_key(driver_id), dict(EMPTY_TOTALS))
+
+
+def _day_expression(field: str) -> dict:
+    return {"$dateFromParts": {
+        "year": {"$year": f"${field}"},
+        "month": {"$month": f"${field}"},
+        "day": {"$dayOfMonth": f"${field}"},
+    }}
+
+
+async def _stream_updates(cursor, to_update, collection) -> int:
+    """Converte resultados de agregação em upserts gravados em lotes"""
+    written = 0
+    batch = []
+    async for row in cursor:
+        batch.append(to_update(row))
+        if len(batch) >= ROLLUP_WRITE_BATCH_SIZE:
+            await collection.bulk_write(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        await collection.bulk_write(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+def _trip_days_pipeline(match: dict) -> list:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"driver_key": "$driver_key", "day": _day_expression("date")},
+            "earnings": {"$sum": "$earnings"},
+            "distance": {"$sum": "$distance"},
+            "trip_count": {"$sum": 1},
+        }},
+    ]
+
+
+def _expense_days_pipeline(match: dict) -> list:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": {"driver_key": "$driver_key", "day": _day_expression("date"), "category": "$category"},
+            "amount": {"$sum": "$amount"},
+            "count": {"$sum": 1},
+        }},
+    ]
+
+
+async def _recompute_days(match: dict, days: Iterable[tuple] = ()) -> int:
+    """
+    Regrava por inteiro (substituição, não incremento) os totais dos dias cujos
+    dados brutos `match` seleciona. Dias de `days` ({(driver_key, dia)}) sem
+    nenhum dado são removidos.
+    """
+    totals = {}
+    async for row in trips_collection.aggregate(_trip_days_pipeline(match)):
+        totals[(row["_id"]["driver_key"], row["_id"]["day"])] = {
+            "earnings": row["earnings"], "distance": row["distance"], "trip_count": row["trip_count"],
+        }
+    async for row in expenses_collection.aggregate(_expense_days_pipeline(match)):
+        day = totals.setdefault((row["_id"]["driver_key"], row["_id"]["day"]), {})
+        day["expenses_total"] = day.get("expenses_total", 0) + row["amount"]
+        day["expense_count"] = day.get("expense_count", 0) + row["count"]
+        by_category = day.setdefault("expenses_by_category", {})
+        category = _category(row["_id"]["category"])
+        by_category[category] = by_category.get(category, 0) + row["amount"]
+
+    operations = []
+    for key, day in set(days) | set(totals):
+        if (key, day) in totals:
+            operations.append(ReplaceOne({"driver_key": key, "day": day},
+                                         {"driver_key": key, "day": day, **totals[(key, day)]}, upsert=True))
+        else:
+            operations.append(DeleteOne({"driver_key": key, "day": day}))
+    for i in range(0, len(operations), ROLLUP_WRITE_BATCH_SIZE):
+        await daily_rollups_collection.bulk_write(operations[i:i + ROLLUP_WRITE_BATCH_SIZE], ordered=False)
+    return len(operations)
+
+
+async def _recompute_dirty_days() -> int:
+    """Recalcula os dias registrados por escritas durante a reconstrução, até não restar nenhum.
+    Cada marcador é removido antes do recálculo: uma escrita concorrente registra o dia de novo."""
+    recomputed = 0
+    while True:
+        markers = await rollup_dirty_days_collection.find({}).limit(ROLLUP_WRITE_BATCH_SIZE).to_list(length=None)
+        if not markers:
+            return recomputed
+        await rollup_dirty_days_collection.delete_many({"_id": {"$in": [marker["_id"] for marker in markers]}})
+        days = {(marker["driver_key"], marker["day"]) for marker in markers}
+        recomputed += await _recompute_days({"$or": [
+            {"driver_key": key, "date": {"$gte": day, "$lt": day + timedelta(days=1)}} for key, day in days
+        ]}, days)
+
+
+async def _claim_full_rebuild() -> bool:
+    """Marca a reconstrução completa como em andamento, se nenhum outro processo a estiver executando"""
+    now = datetime.utcnow()
+    try:
+        await job_checkpoints_collection.update_one(
+            {"_id": ROLLUPS_JOB_ID, "$or": [
+                {"status": {"$ne": "running"}},
+                {"started_at": {"$lt": now - timedelta(seconds=ROLLUPS_REBUILD_LOCK_SECONDS)}},
+            ]},
+            {"$set": {"status": "running", "started_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # O documento existe e está "running": outra reconstrução em andamento
+        return False
+    await _read_state(refresh=True)
+    return True
+
+
+async def _finish_full_rebuild(status: str, **fields):
+    await job_checkpoints_collection.update_one(
+        {"_id": ROLLUPS_JOB_ID}, {"$set": {"status": status, "finished_at": datetime.utcnow(), **fields}}
+    )
+    await _read_state(refresh=True)
+
+
+async def rebuild_daily_rollups(driver_id: Optional[str] = None) -> dict:
+    """Recalcula os totais diários (de um motorista ou de todos) a partir das viagens e despesas.
+
+    A reconstrução completa roda em um processo por vez, sem alterar a coleção em
+    uso até a troca final (ver _rebuild_all). A de um motorista substitui os
+    documentos dele dia a dia.
+    """
+    if driver_id:
+        return await _rebuild_driver(driver_id)
+
+    if not await _claim_full_rebuild():
+        logger.info("Reconstrução dos totais diários já em andamento em outro processo")
+        return {"status": "running"}
+    try:
+        result = await _rebuild_all()
+    except asyncio.CancelledError:
+        await asyncio.shield(_finish_full_rebuild("interrupted"))
+        raise
+    except Exception as e:
+        await _finish_full_rebuild("failed", error=str(e))
+        raise
+    await _finish_full_rebuild("completed", built_at=datetime.utcnow(), result=result)
+
+    # Escritas de processos que ainda não viram "completed" podem ter registrado dias
+    await asyncio.sleep(ROLLUPS_STATE_TTL_SECONDS)
+    await _recompute_dirty_days()
+    return result
+
+
+async def rebuild_status() -> dict:
+    """Situação da última reconstrução completa (job_checkpoints)"""
+    state = await job_checkpoints_collection.find_one({"_id": ROLLUPS_JOB_ID}, {"_id": 0})
+    return state or {"status": "never_run"}
+
+
+async def ensure_daily_rollups() -> dict:
+    """Executa a reconstrução completa se ela ainda não foi concluída (usado na inicialização)"""
+    state = await _read_state(refresh=True)
+    if state.get("built_at") and state.get("status") != "running":
+        return {"status": "completed"}
+    return await rebuild_daily_rollups()
+
+
+async def _rebuild_driver(driver_id: str) -> dict:
+    key = driver_key(driver_id)
+    existing = await daily_rollups_collection.find({"driver_key": key}, {"day": 1}).to_list(length=None)
+    written = await _recompute_days(driver_filter(driver_id), {(key, doc["day"]) for doc in existing})
+    await invalidate_driver_reports(driver_id)
+    result = {"days": written}
+    logger.info(f"Totais diários reconstruídos para {driver_id}: {result}")
+    return result
+
+
+async def _rebuild_all() -> dict:
+    """
+    Monta os totais na coleção de preparação e a troca pela principal. Antes, espera
+    ROLLUPS_STATE_TTL_SECONDS para que todos os processos vejam a reconstrução em
+    andamento (relatórios pelos dados brutos, dias alterados registrados); depois da
+    troca, recalcula os dias alterados durante a montagem.
+    """
+    await rollup_dirty_days_collection.delete_many({})
+    await asyncio.sleep(ROLLUPS_STATE_TTL_SECONDS)
+    await backfill_driver_keys()
+
+    staging = daily_rollups_staging_collection
+    await staging.drop()
+    await staging.create_index([("driver_key", ASCENDING), ("day", ASCENDING)], unique=True)
+
+    trip_days = await _stream_updates(
+        trips_collection.aggregate(_trip_days_pipeline({})),
+        lambda row: UpdateOne(
+            row["_id"],
+            {"$set": {"earnings": row["earnings"], "distance": row["distance"], "trip_count": row["trip_count"]}},
+            upsert=True,
+        ),
+        staging,
+    )
+    expense_rows = await _stream_updates(
+        expenses_collection.aggregate(_expense_days_pipeline({})),
+        lambda row: UpdateOne(
+            {"driver_key": row["_id"]["driver_key"], "day": row["_id"]["day"]},
+            {"$inc": {
+                "expenses_total": row["amount"],
+                "expense_count": row["count"],
+                f"expenses_by_category.{_category(row['_id']['category'])}": row["amount"],
+            }},
+            upsert=True,
+        ),
+        staging,
+    )
+
+    await staging.rename(daily_rollups_collection.name, dropTarget=True)
+    dirty_days = await _recompute_dirty_days()
+    await invalidate_all_reports()
+
+    result = {"trip_days": trip_days, "expense_day_categories": expense_rows, "recomputed_days": dirty_days}
+    logger.info(f"Totais diários reconstruídos: {result}")
+    return result
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        print(__doc__)
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    print(asyncio.run(rebuild_daily_rollups(sys.argv[2] if len(sys.argv) > 2 else None)))
@@ -0,0 +1,156 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from database import trips_collection, expenses_collection
+from models import ExpenseCategory
+from auth import get_current_user_expired_ok
+from utils.pagination import ListFilters
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+def analytics_query(filters: ListFilters) -> dict:
+    """Filtros de motorista e data da listagem (índice driver_key, date, _id)"""
+    return filters.filters("date")
+
+
+@router.get("/earnings")
+async def earnings_analytics(
+    granularity: str = Query("day", pattern="^(day|week|month)$", description="day, week ou month"),
+    by_platform: bool = Query(True, description="Separa os períodos por plataforma"),
+    filters: ListFilters = Depends(),
+    current_user = Depends(get_current_user_expired_ok),
+):
+    """
+    Ganhos, distância, número de viagens e ganho por km agrupados por período
+    (dia, semana iniciada na segunda-feira ou mês) e, opcionalmente, por plataforma.
+    A agregação é feita no MongoDB ($dateTrunc, MongoDB 5.0+): a resposta tem um
+    item por período/plataforma, e não o histórico de viagens.
+    """
+    bucket = {"date": "$date", "unit": granularity}
+    if granularity == "week":
+        bucket["startOfWeek"] = "monday"
+
+    group_id = {"period": {"$dateTrunc": bucket}}
+    if by_platform:
+        group_id["platform"] = "$platform"
+
+    pipeline = [
+        {"$match": analytics_query(filters)},
+        {"$group": {
+            "_id": group_id,
+            "earnings": {"$sum": "$earnings"},
+            "distance": {"$sum": "$distance"},
+            "trip_count": {"$sum": 1},
+        }},
+        {"$sort": {"_id.period": 1, "_id.platform": 1}},
+        {"$project": {
+            "_id": 0,
+            "period": "$_id.period",
+            "platform": "$_id.platform",
+            "earnings": 1,
+            "distance": 1,
+            "trip_count": 1,
+            "earnings_per_km": {"$cond": [
+                {"$gt": ["$distance", 0]}, {"$divide": ["$earnings", "$distance"]}, None
+            ]},
+        }},
+    ]
+
+    try:
+        buckets = await trips_collection.aggregate(pipeline).to_list(length=None)
+    except Exception as e:
+        logger.error(f"Erro ao calcular análise de ganhos: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular análise de ganhos: {str(e)}")
+
+    return {
+        "granularity": granularity,
+        "by_platform": by_platform,
+        "buckets": buckets,
+    }
+
+
+@router.get("/fuel-efficiency")
+async def fuel_efficiency(filters: ListFilters = Depends(), current_user = Depends(get_current_user_expired_ok)):
+    """
+    Consumo (km/l), custo por km e tendência de preço por motorista e tipo de
+    combustível, calculados entre abastecimentos consecutivos.
+
+    Considera abastecimentos de tanque cheio: os km rodados desde o abastecimento
+    anterior do motorista (pelo odômetro) foram feitos com os litros do abastecimento
+    atual. O primeiro abastecimento do período serve apenas de base. Os cálculos usam
+    funções de janela do MongoDB ($setWindowFields, MongoDB 5.0+).
+    """
+    match = {
+        **analytics_query(filters),
+        "category": ExpenseCategory.FUEL.value,
+        "odometer": {"$ne": None},
+        "liters": {"$gt": 0},
+    }
+    valid_interval = {"$gt": ["$km", 0]}
+
+    pipeline = [
+        {"$match": match},
+        # Odômetro do abastecimento anterior do mesmo motorista
+        {"$setWindowFields": {
+            "partitionBy": "$driver_key",
+            "sortBy": {"odometer": 1},
+            "output": {"previous_odometer": {"$shift": {"output": "$odometer", "by": -1}}},
+        }},
+        # Preço do abastecimento anterior com o mesmo combustível
+        {"$setWindowFields": {
+            "partitionBy": {"driver_key": "$driver_key", "fuel_type": "$fuel_type"},
+            "sortBy": {"date": 1},
+            "output": {"previous_price": {"$shift": {"output": "$price_per_liter", "by": -1}}},
+        }},
+        {"$set": {
+            "km": {"$subtract": ["$odometer", "$previous_odometer"]},
+            "price_change": {"$subtract": ["$price_per_liter", "$previous_price"]},
+        }},
+        {"$sort": {"date": 1}},
+        {"$group": {
+            "_id": {"driver_key": "$driver_key", "fuel_type": "$fuel_type"},
+            "driver_id": {"$first": "$driver_id"},
+            "fill_ups": {"$sum": 1},
+            "km": {"$sum": {"$cond": [valid_interval, "$km", 0]}},
+            "liters": {"$sum": {"$cond": [valid_interval, "$liters", 0]}},
+            "cost": {"$sum": {"$cond": [valid_interval, "$amount", 0]}},
+            "first_price": {"$first": "$price_per_liter"},
+            "last_price": {"$last": "$price_per_liter"},
+            "average_price": {"$avg": "$price_per_liter"},
+            "average_price_change": {"$avg": "$price_change"},
+            "first_date": {"$first": "$date"},
+            "last_date": {"$last": "$date"},
+        }},
+        {"$sort": {"_id.driver_key": 1, "_id.fuel_type": 1}},
+        {"$project": {
+            "_id": 0,
+            "driver_id": 1,
+            "fuel_type": "$_id.fuel_type",
+            "fill_ups": 1,
+            "km": 1,
+            "liters": 1,
+            "cost": 1,
+            "km_per_liter": {"$cond": [{"$gt": ["$liters", 0]}, {"$divide": ["$km", "$liters"]}, None]},
+            "cost_per_km": {"$cond": [{"$gt": ["$km", 0]}, {"$divide": ["$cost", "$km"]}, None]},
+            "first_price": 1,
+            "last_price": 1,
+            "average_price": 1,
+            "average_price_change": 1,
+            "price_change_pct": {"$cond": [
+                {"$gt": ["$first_price", 0]},
+                {"$multiply": [{"$divide": [{"$subtract": ["$last_price", "$first_price"]}, "$first_price"]}, 100]},
+                None,
+            ]},
+            "first_date": 1,
+            "last_date": 1,
+        }},
+    ]
+
+    try:
+        results = await expenses_collection.aggregate(pipeline).to_list(length=None)
+    except Exception as e:
+        logger.error(f"Erro ao calcular eficiência de combustível: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Erro ao calcular eficiência de combustível: {str(e)}")
+
+    return {"results": results}
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, status, Response
 from models import Driver, DriverCreate
 from database import drivers_collection
 from bson import ObjectId
+from pymongo import ReturnDocument
 from auth import get_current_user, get_current_user_expired_ok
+from utils.pagination import PageParams, fetch_page
+from utils.fast_json import fast_json_response
 
 router = APIRouter()
 
@@ -30,9 +33,9 @@ async def create_driver(driver: DriverCreate, current_user = Depends(get_current
         # Para versões mais antigas do Pydantic
         driver_dict = driver.dict()
     
-    new_driver = await drivers_collection.insert_one(driver_dict)
-    created_driver = await drivers_collection.find_one({"_id": new_driver.inserted_id})
-    return driver_helper(created_driver)
+    # insert_one preenche o _id no próprio documento: não é preciso relê-lo
+    await drivers_collection.insert_one(driver_dict)
+    return driver_helper(driver_dict)
 
 @router.post("", response_model=Driver)
 async def create_driver_no_slash(driver: DriverCreate, current_user = Depends(get_current_user_expired_ok)):
@@ -40,16 +43,17 @@ async def create_driver_no_slash(driver: DriverCreate, current_user = Depends(ge
     return await create_driver(driver, current_user)
 
 @router.get("/")
-async def get_drivers(current_user = Depends(get_current_user_expired_ok)):
-    drivers = []
-    async for driver in drivers_collection.find({}):
-        drivers.append(driver_helper(driver))
-    return drivers
+async def get_drivers(response: Response, page: PageParams = Depends(),
+                      current_user = Depends(get_current_user_expired_ok)):
+    """Lista os motoristas, do cadastro mais recente para o mais antigo, paginados por cursor"""
+    drivers = await fetch_page(drivers_collection, page, response, driver_helper)
+    return fast_json_response(drivers, response, model=Driver)
 
 @router.get("", response_model=list[Driver])
-async def get_drivers_no_slash(current_user = Depends(get_current_user_expired_ok)):
+async def get_drivers_no_slash(response: Response, page: PageParams = Depends(),
+                               current_user = Depends(get_current_user_expired_ok)):
     """Endpoint alternativo para listar motoristas sem barra no final"""
-    return await get_drivers(current_user)
+    return await get_drivers(response, page, current_user)
 
 @router.get("/{driver_id}", response_model=Driver)
 async def get_driver(driver_id: str, current_user = Depends(get_current_user_expired_ok)):
@@ -67,30 +71,22 @@ async def update_driver(driver_id: str, driver_data: DriverCreate, current_user
         # Para versões mais antigas do Pydantic
         driver_dict = driver_data.dict()
     
-    # Verificar se o motorista existe
-    if not await drivers_collection.find_one({"_id": ObjectId(driver_id)}):
-        raise HTTPException(status_code=404, detail="Motorista não encontrado")
-    
-    # Atualizar dados do motorista
-    updated_driver = await drivers_collection.update_one(
+    # Atualizar dados do motorista, retornando o documento atualizado
+    updated_driver = await drivers_collection.find_one_and_update(
         {"_id": ObjectId(driver_id)},
-        {"$set": driver_dict}
+        {"$set": driver_dict},
+        return_document=ReturnDocument.AFTER
     )
     
-    if updated_driver.modified_count == 1:
-        updated_doc = await drivers_collection.find_one({"_id": ObjectId(driver_id)})
-        return driver_helper(updated_doc)
-    raise HTTPException(status_code=404, detail="Motorista não encontrado ou nenhuma alteração feita")
+    if updated_driver:
+        return driver_helper(updated_driver)
+    raise HTTPException(status_code=404, detail="Motorista não encontrado")
 
 @router.delete("/{driver_id}")
 async def delete_driver(driver_id: str, current_user = Depends(get_current_user)):
-    # Verificar se o motorista existe
-    if not await drivers_collection.find_one({"_id": ObjectId(driver_id)}):
-        raise HTTPException(status_code=404, detail="Motorista não encontrado")
-    
     # Excluir o motorista
     delete_result = await drivers_collection.delete_one({"_id": ObjectId(driver_id)})
     
     if delete_result.deleted_count == 1:
         return {"message": "Motorista excluído com sucesso"}
-    raise HTTPException(status_code=500, detail="Erro ao excluir motorista")
+    raise HTTPException(status_code=404, detail="Motorista não encontrado")
@@ -1,12 +1,22 @@
-from fastapi import APIRouter, HTTPException
-from models import Expense, ExpenseCreate, ExpenseCategory
-from database import expenses_collection, drivers_collection
+from fastapi import APIRouter, HTTPException, Response
+from models import Expense, ExpenseCreate, ExpenseCategory, BulkInsertResult
+from database import expenses_collection, drivers_collection, with_driver_key, driver_filter, bump_collection_version
 from bson import ObjectId
 from datetime import date, datetime
 from auth import get_current_user, get_current_user_expired_ok
+from pymongo import ReturnDocument
+from utils.ownership import owned_by, ownership_failure
+from utils.pagination import FilteredPageParams, ListFilters, fetch_page
+from utils.export import ExportFormat, export_response
+from utils.bulk import bulk_insert
+from rollups import apply_expense_rollups
+from utils.etag import conditional_get
+from utils.fast_json import fast_json_response
+import logging
 from fastapi import Depends
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 def expense_helper(expense) -> dict:
     expense_dict = {
@@ -31,8 +41,8 @@ def expense_helper(expense) -> dict:
     
     return expense_dict
 
-@router.post("/", response_model=Expense)
-async def create_expense(expense: ExpenseCreate, current_user = Depends(get_current_user_expired_ok)):
+def prepare_expense_document(expense: ExpenseCreate, current_user) -> dict:
+    """Converte a despesa recebida no documento gravado no MongoDB"""
     try:
         # Para versões mais recentes do Pydantic
         expense_dict = expense.model_dump()
@@ -44,20 +54,20 @@ async def create_expense(expense: ExpenseCreate, current_user = Depends(get_curr
     
     # Registrar driver_id original para depuração
     original_driver_id = expense_dict.get("driver_id")
-    print(f"Criando despesa com driver_id original: {original_driver_id} (tipo: {type(original_driver_id)})")
+    logger.debug("Criando despesa com driver_id original: %r (tipo: %s)", original_driver_id, type(original_driver_id))
     
     # Garantir que driver_id seja do tipo string (não ObjectId ou outro tipo)
     if "driver_id" in expense_dict and expense_dict["driver_id"] is not None:
         expense_dict["driver_id"] = str(expense_dict["driver_id"])
-        print(f"Driver ID padronizado para string: {expense_dict['driver_id']}")
+        with_driver_key(expense_dict)
+        logger.debug("Driver ID padronizado para string: %s", expense_dict["driver_id"])
     
     # Garantir que amount seja float
     if "amount" in expense_dict:
         try:
             expense_dict["amount"] = float(expense_dict["amount"])
-            print(f"Amount convertido para float: {expense_dict['amount']}")
         except (ValueError, TypeError):
-            print(f"ERRO: Não foi possível converter amount para float")
+            logger.warning("Não foi possível converter amount para float: %r", expense_dict["amount"])
 
     # Verificar se é despesa de combustível e validar campos específicos
     if expense_dict.get("category") == ExpenseCategory.FUEL:
@@ -66,9 +76,8 @@ async def create_expense(expense: ExpenseCreate, current_user = Depends(get_curr
             if field in expense_dict and expense_dict[field] is not None:
                 try:
                     expense_dict[field] = float(expense_dict[field])
-                    print(f"{field.capitalize()} convertido para float: {expense_dict[field]}")
                 except (ValueError, TypeError):
-                    print(f"ERRO: Não foi possível converter {field} para float")
+                    logger.warning("Não foi possível converter %s para float: %r", field, expense_dict[field])
         
         # Verificar se os campos obrigatórios para combustível estão preenchidos
         if not all([
@@ -77,122 +86,98 @@ async def create_expense(expense: ExpenseCreate, current_user = Depends(get_curr
             expense_dict.get("liters") is not None,
             expense_dict.get("price_per_liter") is not None
         ]):
-            print("Aviso: Despesa de combustível com campos incompletos")
+            logger.debug("Despesa de combustível com campos incompletos")
             # Campos opcionais podem ser None, não geramos erro.
 
     # ✅ Converte date para datetime (adiciona meia-noite como hora)
     if isinstance(expense_dict.get("date"), date):
         expense_dict["date"] = datetime.combine(expense_dict["date"], datetime.min.time())
 
-    new_expense = await expenses_collection.insert_one(expense_dict)
-    created_expense = await expenses_collection.find_one({"_id": new_expense.inserted_id})
-    return expense_helper(created_expense)
+    return expense_dict
+
+@router.post("/", response_model=Expense)
+async def create_expense(expense: ExpenseCreate, current_user = Depends(get_current_user_expired_ok)):
+    expense_dict = prepare_expense_document(expense, current_user)
+    # insert_one preenche o _id no próprio documento: não é preciso relê-lo
+    await expenses_collection.insert_one(expense_dict)
+    await apply_expense_rollups(added=[expense_dict])
+    await bump_collection_version("expenses")
+    return expense_helper(expense_dict)
 
 @router.post("", response_model=Expense)
 async def create_expense_no_slash(expense: ExpenseCreate, current_user = Depends(get_current_user_expired_ok)):
     """Endpoint alternativo para criar despesa sem barra no final"""
     return await create_expense(expense, current_user)
 
-@router.get("")
-async def get_expenses():
+async def _after_bulk_insert(expenses: list):
+    await apply_expense_rollups(added=expenses)
+    await bump_collection_version("expenses")
+
+@router.post("/bulk", response_model=BulkInsertResult)
+async def create_expenses_bulk(expenses: list[dict], current_user = Depends(get_current_user_expired_ok)):
+    """
+    Cria várias despesas em uma requisição (ex.: sincronização de um turno).
+    Itens inválidos não impedem a gravação dos demais e são listados em "errors".
+    """
+    return await bulk_insert(expenses_collection, expenses, ExpenseCreate,
+                             lambda expense: prepare_expense_document(expense, current_user),
+                             after_insert=_after_bulk_insert)
+
+@router.get("", dependencies=[Depends(conditional_get("expenses"))])
+async def get_expenses(response: Response, page: FilteredPageParams = Depends()):
+    """
+    Retorna as despesas, da mais recente para a mais antiga, paginadas por cursor.
+    Filtros opcionais: driver_id, start_date e end_date.
+    """
     try:
-        expenses = []
-        async for expense in expenses_collection.find({}):
-            try:
-                expenses.append(expense_helper(expense))
-            except KeyError as e:
-                # Log do erro e continua sem adicionar o documento problemático
-                print(f"Erro ao processar despesa {expense.get('_id')}: {str(e)}")
-                continue
-        return expenses
+        expenses = await fetch_page(expenses_collection, page, response, expense_helper, sort_field="date")
+        return fast_json_response(expenses, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar despesas: {str(e)}")
 
-@router.get("/{expense_id}", response_model=Expense)
+EXPENSE_EXPORT_COLUMNS = [
+    "id", "user_id", "driver_id", "trip_id", "category", "amount", "date", "description",
+    "odometer", "fuel_type", "liters", "price_per_liter",
+]
+
+@router.get("/export")
+async def export_expenses(filters: ListFilters = Depends(), export: ExportFormat = Depends(),
+                          current_user = Depends(get_current_user_expired_ok)):
+    """
+    Exporta as despesas em CSV ou NDJSON, em ordem cronológica, via streaming.
+    Filtros opcionais: driver_id, start_date e end_date.
+    """
+    return export_response(expenses_collection, filters.filters("date"), expense_helper,
+                           EXPENSE_EXPORT_COLUMNS, export.format, "despesas")
+
+@router.get("/{expense_id}", response_model=Expense, dependencies=[Depends(conditional_get("expenses"))])
 async def get_expense(expense_id: str):
     expense = await expenses_collection.find_one({"_id": ObjectId(expense_id)})
     if expense:
         return expense_helper(expense)
     raise HTTPException(status_code=404, detail="Despesa não encontrada")
 
-@router.get("/driver/{driver_id}")
-async def get_expenses_by_driver(driver_id: str):
-    print(f"Buscando despesas para driver_id: {driver_id}")
-    
-    def ids_sao_similares(id1, id2):
-        """Verifica se dois IDs representam provavelmente o mesmo motorista"""
-        if id1 is None or id2 is None:
-            return False
-            
-        # Converter ambos para string para comparação
-        id1_str = str(id1).lower().strip()
-        id2_str = str(id2).lower().strip()
-        
-        # Verificar se são iguais após normalização
-        if id1_str == id2_str:
-            return True
-            
-        # Verificar se um contém o outro completamente (substring)
-        if id1_str in id2_str or id2_str in id1_str:
-            return True
-            
-        # Verificar se um é representação numérica do outro
-        try:
-            if id1_str.isdigit() and id2_str == id1_str:
-                return True
-        except:
-            pass
-            
-        return False
-    
-    # Estratégia 1: Verificar variações óbvias
-    consulta_basica = {
-        "$or": [
-            {"driver_id": driver_id},
-            {"driver_id": driver_id.strip()},
-            {"driver_id": driver_id.lower()},
-            {"driver_id": driver_id.upper()},
-            {"driver_id": str(driver_id)}
-        ]
-    }
-    
-    # Buscar despesas primeiro com consulta básica
+@router.get("/driver/{driver_id}", dependencies=[Depends(conditional_get("expenses"))])
+async def get_expenses_by_driver(driver_id: str, response: Response):
+    """
+    Retorna as despesas do motorista pela chave normalizada (driver_key), que
+    equivale a variações de caixa e espaços do driver_id e é servida por índice.
+    """
     expenses = []
-    async for expense in expenses_collection.find(consulta_basica):
-        print(f"Despesa encontrada (consulta básica): ID={expense.get('_id')} driver_id={expense.get('driver_id')}")
+    async for expense in expenses_collection.find(driver_filter(driver_id)).sort("date", 1):
         expenses.append(expense_helper(expense))
-    
-    # Se não encontrou nada, tenta estratégia mais agressiva
-    if not expenses:
-        print("Nenhuma despesa encontrada na consulta básica. Tentando estratégia avançada...")
-        # Busca todas as despesas e filtra manualmente
-        todas_despesas = await expenses_collection.find({}).to_list(length=None)
-        print(f"Total de despesas no banco: {len(todas_despesas)}")
-        
-        for expense in todas_despesas:
-            expense_driver_id = expense.get("driver_id")
-            if ids_sao_similares(expense_driver_id, driver_id):
-                print(f"Match encontrado: despesa {expense['_id']} com driver_id '{expense_driver_id}'")
-                expenses.append(expense_helper(expense))
-    
-    print(f"Total de despesas encontradas: {len(expenses)}")
-    return expenses
+    return fast_json_response(expenses, response)
 
 @router.get("/normalize/{driver_id}")
 async def normalize_expenses_driver_id(driver_id: str, current_user = Depends(get_current_user)):
     """Normaliza o driver_id nas despesas existentes"""
-    print(f"Normalizando driver_id '{driver_id}' nas despesas...")
-    
-    # Encontrar todas as variações deste driver_id
-    all_expenses = await expenses_collection.find({}).to_list(length=None)
-    variantes_encontradas = []
+    logger.info("Normalizando driver_id %r nas despesas", driver_id)
     
-    for expense in all_expenses:
-        expense_driver_id = expense.get("driver_id")
-        # Verificar se este ID é uma variante do driver_id fornecido
-        if expense_driver_id and (str(expense_driver_id).lower().strip() == str(driver_id).lower().strip()):
-            if expense_driver_id != driver_id and expense_driver_id not in variantes_encontradas:
-                variantes_encontradas.append(expense_driver_id)
+    # Encontrar todas as variações deste driver_id (mesma driver_key)
+    variantes_encontradas = [
+        variante for variante in await expenses_collection.distinct("driver_id", driver_filter(driver_id))
+        if variante != driver_id
+    ]
     
     # Atualizar todas as variantes para o ID normalizado
     resultados = []
@@ -206,6 +191,8 @@ async def normalize_expenses_driver_id(driver_id: str, current_user = Depends(ge
             "para": driver_id,
             "atualizados": resultado.modified_count
         })
+    if variantes_encontradas:
+        await bump_collection_version("expenses")
     
     return {
         "driver_id_normalizado": driver_id,
@@ -219,14 +206,6 @@ async def update_expense(expense_id: str, expense_data: ExpenseCreate,
                          current_user=Depends(get_current_user_expired_ok)):
     """Atualiza uma despesa existente"""
     try:
-        # Verifica se a despesa existe e pertence ao usuário
-        existing_expense = await expenses_collection.find_one({"_id": ObjectId(expense_id)})
-        if not existing_expense:
-            raise HTTPException(status_code=404, detail="Despesa não encontrada")
-
-        if str(existing_expense.get("user_id")) != current_user.id:
-            raise HTTPException(status_code=403, detail="Sem permissão para atualizar esta despesa")
-
         # Prepara os dados para atualização
         try:
             update_data = expense_data.model_dump()
@@ -238,6 +217,7 @@ async def update_expense(expense_id: str, expense_data: ExpenseCreate,
         # Garante que driver_id seja string
         if "driver_id" in update_data:
             update_data["driver_id"] = str(update_data["driver_id"])
+            with_driver_key(update_data)
 
         # Converte valores numéricos para float
         if "amount" in update_data:
@@ -253,16 +233,23 @@ async def update_expense(expense_id: str, expense_data: ExpenseCreate,
         if isinstance(update_data.get("date"), date):
             update_data["date"] = datetime.combine(update_data["date"], datetime.min.time())
 
-        # Atualiza a despesa
-        await expenses_collection.update_one(
-            {"_id": ObjectId(expense_id)},
-            {"$set": update_data}
+        # Atualiza a despesa somente se ela pertencer ao usuário. A versão anterior
+        # é retornada para que os totais diários possam ser corrigidos.
+        previous_expense = await expenses_collection.find_one_and_update(
+            owned_by(expense_id, current_user),
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
         )
-
-        # Retorna a despesa atualizada
-        updated_expense = await expenses_collection.find_one({"_id": ObjectId(expense_id)})
+        if not previous_expense:
+            raise await ownership_failure(expenses_collection, expense_id, "Despesa não encontrada",
+                                          "Sem permissão para atualizar esta despesa")
+        updated_expense = {**previous_expense, **update_data}
+        await apply_expense_rollups(added=[updated_expense], removed=[previous_expense])
+        await bump_collection_version("expenses")
         return expense_helper(updated_expense)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar despesa: {str(e)}")
 
@@ -271,21 +258,16 @@ async def update_expense(expense_id: str, expense_data: ExpenseCreate,
 async def delete_expense(expense_id: str, current_user=Depends(get_current_user_expired_ok)):
     """Exclui uma despesa específica"""
     try:
-        # Verifica se a despesa existe e pertence ao usuário
-        existing_expense = await expenses_collection.find_one({"_id": ObjectId(expense_id)})
-        if not existing_expense:
-            raise HTTPException(status_code=404, detail="Despesa não encontrada")
-
-        if str(existing_expense.get("user_id")) != current_user.id:
-            raise HTTPException(status_code=403, detail="Sem permissão para excluir esta despesa")
-
-        # Exclui a despesa
-        result = await expenses_collection.delete_one({"_id": ObjectId(expense_id)})
-
-        if result.deleted_count == 1:
-            return {"mensagem": "Despesa excluída com sucesso"}
-        else:
-            raise HTTPException(status_code=404, detail="Despesa não encontrada")
+        # Exclui a despesa somente se ela pertencer ao usuário
+        deleted_expense = await expenses_collection.find_one_and_delete(owned_by(expense_id, current_user))
+        if not deleted_expense:
+            raise await ownership_failure(expenses_collection, expense_id, "Despesa não encontrada",
+                                          "Sem permissão para excluir esta despesa")
+        await apply_expense_rollups(removed=[deleted_expense])
+        await bump_collection_version("expenses")
+        return {"mensagem": "Despesa excluída com sucesso"}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao excluir despesa: {str(e)}")
@@ -1,12 +1,22 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Response
 from fastapi import Depends
 from models import Goal, GoalCreate
-from database import goals_collection, expenses_collection, trips_collection
+from database import goals_collection, expenses_collection, trips_collection, with_driver_key, driver_filter, driver_key
+from database import bump_collection_version
+from pymongo import ReturnDocument, UpdateOne
+from utils.ownership import owned_by, ownership_failure
+from typing import Optional
 from bson import ObjectId
 from datetime import date, datetime
 from auth import get_current_user, get_current_user_expired_ok
+from utils.pagination import FilteredPageParams, fetch_page
+from report_cache import invalidate_driver_reports
+from utils.etag import conditional_get
+from utils.fast_json import fast_json_response
+import logging
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 
 def goal_helper(goal) -> dict:
@@ -35,33 +45,36 @@ async def create_goal(goal: GoalCreate, current_user = Depends(get_current_user_
         
         # Registrar driver_id original para depuração
         original_driver_id = goal_dict.get("driver_id")
-        print(f"Criando meta com driver_id original: {original_driver_id} (tipo: {type(original_driver_id)})")
+        logger.debug("Criando meta com driver_id original: %r (tipo: %s)", original_driver_id, type(original_driver_id))
         
         # Garantir que driver_id seja do tipo string (não ObjectId ou outro tipo)
         if "driver_id" in goal_dict and goal_dict["driver_id"] is not None:
             goal_dict["driver_id"] = str(goal_dict["driver_id"])
-            print(f"Driver ID padronizado para string: {goal_dict['driver_id']}")
+            with_driver_key(goal_dict)
+            logger.debug("Driver ID padronizado para string: %s", goal_dict["driver_id"])
         
         # Garantir que os valores numéricos sejam tipo float
         if "target_amount" in goal_dict:
             try:
                 goal_dict["target_amount"] = float(goal_dict["target_amount"])
             except (ValueError, TypeError):
-                print(f"ERRO: Não foi possível converter target_amount para float")
+                logger.warning("Não foi possível converter target_amount para float: %r", goal_dict["target_amount"])
                 
         if "current_amount" in goal_dict:
             try:
                 goal_dict["current_amount"] = float(goal_dict["current_amount"])
             except (ValueError, TypeError):
-                print(f"ERRO: Não foi possível converter current_amount para float")
+                logger.warning("Não foi possível converter current_amount para float: %r", goal_dict["current_amount"])
         
         # Converter date para datetime antes de salvar no MongoDB
         if isinstance(goal_dict.get("deadline"), date):
             goal_dict["deadline"] = datetime.combine(goal_dict["deadline"], datetime.min.time())
         
-        new_goal = await goals_collection.insert_one(goal_dict)
-        created_goal = await goals_collection.find_one({"_id": new_goal.inserted_id})
-        return goal_helper(created_goal)
+        # insert_one preenche o _id no próprio documento: não é preciso relê-lo
+        await goals_collection.insert_one(goal_dict)
+        await invalidate_driver_reports(goal_dict.get("driver_id"))
+        await bump_collection_version("goals")
+        return goal_helper(goal_dict)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao criar meta: {str(e)}")
 
@@ -71,36 +84,33 @@ async def create_goal_no_slash(goal: GoalCreate, current_user = Depends(get_curr
     return await create_goal(goal, current_user)
 
 
-@router.get("/")
-async def get_goals():
+@router.get("/", dependencies=[Depends(conditional_get("goals"))])
+async def get_goals(response: Response, page: FilteredPageParams = Depends()):
+    """
+    Retorna as metas, do prazo mais distante para o mais próximo, paginadas por cursor.
+    Filtros opcionais: driver_id e intervalo de prazo (start_date, end_date).
+    """
     try:
-        goals = []
-        async for goal in goals_collection.find({}):
-            try:
-                goals.append(goal_helper(goal))
-            except KeyError as e:
-                # Log do erro e continua sem adicionar o documento problemático
-                print(f"Erro ao processar meta {goal.get('_id')}: {str(e)}")
-                continue
-        return goals
+        goals = await fetch_page(goals_collection, page, response, goal_helper, sort_field="deadline")
+        return fast_json_response(goals, response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar metas: {str(e)}")
 
-@router.get("")
-async def get_goals_no_slash():
+@router.get("", dependencies=[Depends(conditional_get("goals"))])
+async def get_goals_no_slash(response: Response, page: FilteredPageParams = Depends()):
     """Endpoint alternativo para buscar metas sem barra no final"""
-    return await get_goals()
+    return await get_goals(response, page)
 
 
-@router.get("/driver/{driver_id}")
-async def get_goals_by_driver(driver_id: str):
+@router.get("/driver/{driver_id}", dependencies=[Depends(conditional_get("goals"))])
+async def get_goals_by_driver(driver_id: str, response: Response):
     goals = []
-    async for goal in goals_collection.find({"driver_id": driver_id}):
+    async for goal in goals_collection.find(driver_filter(driver_id)):
         goals.append(goal_helper(goal))
-    return goals
+    return fast_json_response(goals, response)
 
 
-@router.get("/{goal_id}", response_model=Goal)
+@router.get("/{goal_id}", response_model=Goal, dependencies=[Depends(conditional_get("goals"))])
 async def get_goal(goal_id: str):
     goal = await goals_collection.find_one({"_id": ObjectId(goal_id)})
     if goal:
@@ -108,56 +118,62 @@ async def get_goal(goal_id: str):
     raise HTTPException(status_code=404, detail="Meta não encontrada")
 
 
+async def driver_net_profits(keys: list) -> dict:
+    """
+    Ganhos menos despesas de cada motorista (por driver_key), calculados numa
+    única agregação: as viagens são somadas por motorista e as despesas entram
+    pelo $unionWith, ambas usando o índice de driver_key.
+    """
+    match = {"$match": {"driver_key": {"$in": list(keys)}}}
+    totals = await trips_collection.aggregate([
+        match,
+        {"$group": {"_id": "$driver_key", "earnings": {"$sum": "$earnings"}}},
+        {"$unionWith": {"coll": expenses_collection.name, "pipeline": [
+            match,
+            {"$group": {"_id": "$driver_key", "expenses": {"$sum": "$amount"}}},
+        ]}},
+        {"$group": {"_id": "$_id", "earnings": {"$sum": "$earnings"}, "expenses": {"$sum": "$expenses"}}},
+    ]).to_list(length=None)
+    return {item["_id"]: item["earnings"] - item["expenses"] for item in totals}
+
+
+@router.put("/update-progress")
+async def update_goals_progress(driver_id: Optional[str] = None, current_user = Depends(get_current_user_expired_ok)):
+    """
+    Atualiza de uma só vez o progresso de todas as metas de um motorista
+    (driver_id) ou, sem driver_id, de todas as metas do usuário atual.
+    """
+    query = driver_filter(driver_id) if driver_id else {"user_id": current_user.id}
+    goals = await goals_collection.find(query, {"driver_id": 1}).to_list(length=None)
+    if not goals:
+        return {"updated": 0}
+
+    profits = await driver_net_profits({driver_key(goal["driver_id"]) for goal in goals})
+    result = await goals_collection.bulk_write([
+        UpdateOne({"_id": goal["_id"]}, {"$set": {"current_amount": profits.get(driver_key(goal["driver_id"]), 0.0)}})
+        for goal in goals
+    ], ordered=False)
+    if result.modified_count:
+        await bump_collection_version("goals")
+    return {"updated": result.modified_count, "matched": result.matched_count}
+
+
 @router.put("/{goal_id}/update-progress")
 async def update_goal_progress(goal_id: str):
-    goal = await goals_collection.find_one({"_id": ObjectId(goal_id)})
+    goal = await goals_collection.find_one({"_id": ObjectId(goal_id)}, {"driver_id": 1})
     if not goal:
         raise HTTPException(status_code=404, detail="Meta não encontrada")
 
-    driver_id = goal["driver_id"]
-    print(f"Atualizando progresso para motorista: {driver_id}")
-    
-    # Buscar todas as possíveis variações deste driver_id
-    all_trips = await trips_collection.find({}).to_list(length=None)
-    similar_driver_ids = set()
-    for trip in all_trips:
-        trip_driver_id = trip.get('driver_id')
-        if trip_driver_id and (trip_driver_id.lower() == driver_id.lower() or 
-                               trip_driver_id.strip() == driver_id.strip()):
-            similar_driver_ids.add(trip_driver_id)
-    
-    # Adicionar o driver_id original
-    similar_driver_ids.add(driver_id)
-    print(f"Variações de driver_id encontradas: {similar_driver_ids}")
-    
-    # Calcular ganhos totais do motorista considerando todas variações
-    total_trips = await trips_collection.aggregate([
-        {"$match": {"driver_id": {"$in": list(similar_driver_ids)}}},
-        {"$group": {"_id": None, "total": {"$sum": {"$toDouble": "$earnings"}}}}
-    ]).to_list(length=None)
-
-    total_earnings = total_trips[0]["total"] if total_trips else 0
-    print(f"Total de ganhos: {total_earnings}")
-
-    # Calcular despesas totais do motorista considerando todas variações
-    total_expenses = await expenses_collection.aggregate([
-        {"$match": {"driver_id": {"$in": list(similar_driver_ids)}}},
-        {"$group": {"_id": None, "total": {"$sum": {"$toDouble": "$amount"}}}}
-    ]).to_list(length=None)
-
-    total_spent = total_expenses[0]["total"] if total_expenses else 0
-    print(f"Total de despesas: {total_spent}")
-
-    # Calcular lucro líquido
-    net_profit = total_earnings - total_spent
+    key = driver_key(goal["driver_id"])
+    net_profit = (await driver_net_profits([key])).get(key, 0.0)
 
     # Atualizar meta
-    await goals_collection.update_one(
-        {"_id": ObjectId(goal_id)},
-        {"$set": {"current_amount": net_profit}}
+    updated_goal = await goals_collection.find_one_and_update(
+        {"_id": goal["_id"]},
+        {"$set": {"current_amount": net_profit}},
+        return_document=ReturnDocument.AFTER
     )
-
-    updated_goal = await goals_collection.find_one({"_id": ObjectId(goal_id)})
+    await bump_collection_version("goals")
     return goal_helper(updated_goal)
 
 
@@ -165,14 +181,6 @@ async def update_goal_progress(goal_id: str):
 async def update_goal(goal_id: str, goal_data: GoalCreate, current_user = Depends(get_current_user_expired_ok)):
     """Atualiza uma meta existente"""
     try:
-        # Verifica se a meta existe e pertence ao usuário
-        existing_goal = await goals_collection.find_one({"_id": ObjectId(goal_id)})
-        if not existing_goal:
-            raise HTTPException(status_code=404, detail="Meta não encontrada")
-
-        if str(existing_goal.get("user_id")) != current_user.id:
-            raise HTTPException(status_code=403, detail="Sem permissão para atualizar esta meta")
-
         # Prepara os dados para atualização
         try:
             update_data = goal_data.model_dump()
@@ -184,6 +192,7 @@ async def update_goal(goal_id: str, goal_data: GoalCreate, current_user = Depend
         # Garante que driver_id seja string
         if "driver_id" in update_data:
             update_data["driver_id"] = str(update_data["driver_id"])
+            with_driver_key(update_data)
 
         # Converte valores numéricos para float
         if "target_amount" in update_data:
@@ -193,16 +202,22 @@ async def update_goal(goal_id: str, goal_data: GoalCreate, current_user = Depend
         if isinstance(update_data.get("deadline"), date):
             update_data["deadline"] = datetime.combine(update_data["deadline"], datetime.min.time())
 
-        # Atualiza a meta
-        await goals_collection.update_one(
-            {"_id": ObjectId(goal_id)},
-            {"$set": update_data}
+        # Atualiza a meta somente se ela pertencer ao usuário. A versão anterior é
+        # retornada para invalidar também os relatórios do motorista antigo.
+        previous_goal = await goals_collection.find_one_and_update(
+            owned_by(goal_id, current_user),
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
         )
-
-        # Retorna a meta atualizada
-        updated_goal = await goals_collection.find_one({"_id": ObjectId(goal_id)})
-        return goal_helper(updated_goal)
-
+        if not previous_goal:
+            raise await ownership_failure(goals_collection, goal_id, "Meta não encontrada",
+                                          "Sem permissão para atualizar esta meta")
+        await invalidate_driver_reports(previous_goal.get("driver_id"), update_data.get("driver_id"))
+        await bump_collection_version("goals")
+        return goal_helper({**previous_goal, **update_data})
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar meta: {str(e)}")
 
@@ -210,22 +225,17 @@ async def update_goal(goal_id: str, goal_data: GoalCreate, current_user = Depend
 async def delete_goal(goal_id: str, current_user = Depends(get_current_user_expired_ok)):
     """Exclui uma meta específica"""
     try:
-        # Verifica se a meta existe e pertence ao usuário
-        existing_goal = await goals_collection.find_one({"_id": ObjectId(goal_id)})
-        if not existing_goal:
-            raise HTTPException(status_code=404, detail="Meta não encontrada")
-
-        if str(existing_goal.get("user_id")) != current_user.id:
-            raise HTTPException(status_code=403, detail="Sem permissão para excluir esta meta")
-
-        # Exclui a meta
-        result = await goals_collection.delete_one({"_id": ObjectId(goal_id)})
-
-        if result.deleted_count == 1:
-            return {"mensagem": "Meta excluída com sucesso"}
-        else:
-            raise HTTPException(status_code=404, detail="Meta não encontrada")
-
+        # Exclui a meta somente se ela pertencer ao usuário
+        deleted_goal = await goals_collection.find_one_and_delete(owned_by(goal_id, current_user))
+        if not deleted_goal:
+            raise await ownership_failure(goals_collection, goal_id, "Meta não encontrada",
+                                          "Sem permissão para excluir esta meta")
+        await invalidate_driver_reports(deleted_goal.get("driver_id"))
+        await bump_collection_version("goals")
+        return {"mensagem": "Meta excluída com sucesso"}
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao excluir meta: {str(e)}")
 
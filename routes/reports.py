@@ -1,17 +1,21 @@
 from fastapi import APIRouter, HTTPException, Header
 from fastapi import Depends, Request, status
 from auth import get_current_user, oauth2_scheme, jwt, SECRET_KEY, ALGORITHM, get_current_user_expired_ok
-from models import ReportBase
-from database import reports_collection, trips_collection, expenses_collection, goals_collection
+from models import ReportBase, Report, ReportBatchRequest
+from database import reports_collection, trips_collection, expenses_collection, goals_collection, with_driver_key, driver_filter, driver_key
 from datetime import date, datetime
 from bson import ObjectId
+from rollups import driver_period_totals, drivers_period_totals, EMPTY_TOTALS
+from utils.bulk import BULK_MAX_ITEMS
+from report_cache import report_key, find_cached_report, is_cached_report, REPORT_CACHE_VERSION
+from report_cache import read_generations, mark_stale_if_invalidated
+from pymongo import ReturnDocument, InsertOne, UpdateOne
+from utils.timing import timed, gather_timed
 import logging
 from jose import JWTError, ExpiredSignatureError
 import json
 
-# Configurar logger para depuração
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
 
 router = APIRouter()
 
@@ -44,6 +48,16 @@ def report_helper(report) -> dict:
         "goals_progress": report.get("goals_progress", {})
     }
 
+def compute_goals_progress(goals, net_profit: float) -> dict:
+    """Progresso (em %) de cada meta em relação ao lucro líquido do período"""
+    return {
+        str(goal["_id"]): {
+            "name": goal["name"],
+            "progress": min((net_profit / goal["target_amount"]) * 100, 100) if goal["target_amount"] > 0 else 0
+        }
+        for goal in goals
+    }
+
 async def process_report_request(data: dict, current_user):
     """
     Função de utilidade para processar solicitações de relatório
@@ -67,36 +81,33 @@ async def process_report_request(data: dict, current_user):
         logger.error(f"Erro ao converter datas: {e}")
         raise HTTPException(status_code=400, detail="Formato de data inválido")
 
-    # Ajustar fim do dia para end_date
-    query_end_date = datetime.combine(end_date_dt.date(), datetime.max.time())
-
-    # Consultar ganhos e despesas
-    total_earnings = await trips_collection.aggregate([
-        {"$match": {"driver_id": driver_id, "date": {"$gte": start_date_dt, "$lte": query_end_date}}},
-        {"$group": {"_id": None, "total": {"$sum": "$earnings"}}}
-    ]).to_list(length=1)
+    # Solicitações repetidas devolvem o relatório já gerado enquanto nenhuma
+    # viagem, despesa ou meta do motorista no período for alterada
+    stages = {}
+    # A geração do motorista é lida antes dos totais (ver report_cache.mark_stale_if_invalidated)
+    cached_report, generations = await gather_timed(
+        stages,
+        cache=find_cached_report(driver_id, start_date_dt, end_date_dt),
+        generation=read_generations([driver_key(driver_id)]),
+    )
+    if cached_report:
+        logger.info(f"Relatório em cache retornado: {cached_report['_id']} (tempos em ms: {stages})")
+        return report_helper(cached_report)
 
-    total_expenses = await expenses_collection.aggregate([
-        {"$match": {"driver_id": driver_id, "date": {"$gte": start_date_dt, "$lte": query_end_date}}},
-        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
-    ]).to_list(length=1)
-
-    total_earnings = total_earnings[0]["total"] if total_earnings else 0.0
-    total_expenses = total_expenses[0]["total"] if total_expenses else 0.0
+    # Ganhos e despesas (somados a partir dos totais diários, um documento por dia
+    # do período) e metas são consultas independentes: executadas em paralelo
+    totals, goals = await gather_timed(
+        stages,
+        totals=driver_period_totals(driver_id, start_date_dt, end_date_dt),
+        goals=goals_collection.find(driver_filter(driver_id)).to_list(length=None),
+    )
+    total_earnings = totals["earnings"]
+    total_expenses = totals["expenses"]
     net_profit = total_earnings - total_expenses
 
     logger.info(f"Ganhos totais: {total_earnings}, Despesas totais: {total_expenses}, Lucro líquido: {net_profit}")
 
-    # Consultar metas
-    goals_cursor = goals_collection.find({"driver_id": driver_id})
-    goals = await goals_cursor.to_list(length=None)
-    goals_progress = {
-        str(goal["_id"]): {
-            "name": goal["name"],
-            "progress": min((net_profit / goal["target_amount"]) * 100, 100) if goal["target_amount"] > 0 else 0
-        }
-        for goal in goals
-    }
+    goals_progress = compute_goals_progress(goals, net_profit)
 
     # Criar relatório
     report_data = {
@@ -107,14 +118,22 @@ async def process_report_request(data: dict, current_user):
         "total_earnings": total_earnings,
         "total_expenses": total_expenses,
         "net_profit": net_profit,
-        "goals_progress": goals_progress
+        "goals_progress": goals_progress,
+        "cache_version": REPORT_CACHE_VERSION
     }
 
-    new_report = await reports_collection.insert_one(report_data)
-    created_report = await reports_collection.find_one({"_id": new_report.inserted_id})
+    with_driver_key(report_data)
+    # Regrava o relatório desatualizado (ou anterior ao cache) do mesmo período, se existir, em vez de inserir outro
+    saved_report = await timed(stages, "save", reports_collection.find_one_and_update(
+        report_key(driver_id, start_date_dt, end_date_dt),
+        {"$set": report_data, "$unset": {"stale": ""}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    ))
+    await mark_stale_if_invalidated({driver_key(driver_id): saved_report["_id"]}, generations)
 
-    logger.info("Relatório gerado com sucesso.")
-    return report_helper(created_report)
+    logger.info(f"Relatório gerado com sucesso (tempos em ms: {stages}).")
+    return report_helper(saved_report)
 
 # Endpoint com a barra final
 @router.post("/", response_model=ReportBase)
@@ -134,14 +153,89 @@ async def generate_report_no_slash(data: dict, current_user=Depends(get_current_
     logger.info("Iniciando geração de relatório (endpoint sem barra).")
     return await process_report_request(data, current_user)
 
+@router.post("/batch", response_model=list[Report])
+async def generate_reports_batch(batch: ReportBatchRequest, current_user=Depends(get_current_user_expired_ok)):
+    """
+    Gera os relatórios de vários motoristas para o mesmo período.
+
+    Relatórios ainda válidos são reaproveitados; os demais são calculados com uma
+    agregação agrupada por motorista sobre os totais diários e uma única consulta
+    de metas, e gravados numa única operação em lote. Motoristas repetidos (mesma
+    driver_key) geram um só relatório.
+    """
+    if len(batch.driver_ids) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Lote excede o limite de {BULK_MAX_ITEMS} motoristas")
+
+    period_start = datetime.combine(batch.start_date, datetime.min.time())
+    period_end = datetime.combine(batch.end_date, datetime.min.time())
+
+    drivers = {}
+    for driver_id in batch.driver_ids:
+        drivers.setdefault(driver_key(driver_id), driver_id)
+
+    stages = {}
+    existing = await timed(stages, "cache", reports_collection.find({
+        "driver_key": {"$in": list(drivers)}, "period_start": period_start, "period_end": period_end,
+    }).to_list(length=None))
+
+    cached, stale_ids = {}, {}
+    for report in existing:
+        if is_cached_report(report):
+            cached.setdefault(report["driver_key"], report)
+        else:
+            # Desatualizado ou anterior ao cache: recalculado e regravado
+            stale_ids.setdefault(report["driver_key"], report["_id"])
+
+    pending = [key for key in drivers if key not in cached]
+    operations = []
+    if pending:
+        generations = await timed(stages, "generation", read_generations(pending))
+        totals, goals = await gather_timed(
+            stages,
+            totals=drivers_period_totals(pending, period_start, period_end),
+            goals=goals_collection.find({"driver_key": {"$in": pending}}).to_list(length=None),
+        )
+        goals_by_driver = {}
+        for goal in goals:
+            goals_by_driver.setdefault(driver_key(goal["driver_id"]), []).append(goal)
+
+        for key in pending:
+            driver_totals = totals.get(key, EMPTY_TOTALS)
+            net_profit = driver_totals["earnings"] - driver_totals["expenses"]
+            report_data = with_driver_key({
+                "user_id": current_user.id,
+                "driver_id": drivers[key],
+                "period_start": period_start,
+                "period_end": period_end,
+                "total_earnings": driver_totals["earnings"],
+                "total_expenses": driver_totals["expenses"],
+                "net_profit": net_profit,
+                "goals_progress": compute_goals_progress(goals_by_driver.get(key, []), net_profit),
+                "cache_version": REPORT_CACHE_VERSION,
+            })
+            # Relatórios desatualizados ou anteriores ao cache são regravados no mesmo documento
+            if key in stale_ids:
+                operations.append(UpdateOne({"_id": stale_ids[key]}, {"$set": report_data, "$unset": {"stale": ""}}))
+                report_data["_id"] = stale_ids[key]
+            else:
+                report_data["_id"] = ObjectId()
+                operations.append(InsertOne(report_data))
+            cached[key] = report_data
+
+        await timed(stages, "save", reports_collection.bulk_write(operations, ordered=False))
+        await mark_stale_if_invalidated({key: cached[key]["_id"] for key in pending}, generations)
+
+    logger.info(f"Relatórios em lote: {len(drivers)} motoristas, {len(operations)} gerados "
+                f"(tempos em ms: {stages})")
+    return [report_helper(cached[key]) for key in drivers]
+
 @router.get("/driver/{driver_id}")
 async def get_reports_by_driver(driver_id: str, current_user = Depends(get_current_user)):
     try:
         reports = []
-        # Imprimir o driver_id para verificar o valor recebido
-        print(f"Buscando relatórios para driver_id: {driver_id}")
+        logger.debug("Buscando relatórios para driver_id: %s", driver_id)
         
-        cursor = reports_collection.find({"driver_id": driver_id})
+        cursor = reports_collection.find(driver_filter(driver_id))
         reports_count = 0
         
         async for report in cursor:
@@ -149,13 +243,13 @@ async def get_reports_by_driver(driver_id: str, current_user = Depends(get_curre
             try:
                 reports.append(report_helper(report))
             except Exception as e:
-                print(f"Erro ao processar relatório {report.get('_id')}: {str(e)}")
+                logger.warning("Erro ao processar relatório %s: %s", report.get("_id"), e)
                 continue
         
-        print(f"Total de relatórios encontrados: {reports_count}")
+        logger.debug("Total de relatórios encontrados: %d", reports_count)
         return reports
     except Exception as e:
-        print(f"Erro na busca de relatórios: {str(e)}")
+        logger.error("Erro na busca de relatórios: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500, 
             detail=f"Erro ao buscar relatórios para o motorista {driver_id}: {str(e)}"
@@ -214,17 +308,15 @@ async def verify_report_data(data: dict, current_user = Depends(get_current_user
     # Ajustar fim do dia para end_date
     query_end_date = datetime.combine(end_date_dt.date(), datetime.max.time())
     
-    # Verificar viagens
-    trips_count = await trips_collection.count_documents({
-        "driver_id": driver_id,
-        "date": {"$gte": start_date_dt, "$lte": query_end_date}
-    })
-    
-    # Verificar despesas
-    expenses_count = await expenses_collection.count_documents({
-        "driver_id": driver_id,
-        "date": {"$gte": start_date_dt, "$lte": query_end_date}
-    })
+    # Contagens de viagens e despesas executadas em paralelo
+    period_query = {**driver_filter(driver_id), "date": {"$gte": start_date_dt, "$lte": query_end_date}}
+    stages = {}
+    trips_count, expenses_count = await gather_timed(
+        stages,
+        trips=trips_collection.count_documents(period_query),
+        expenses=expenses_collection.count_documents(period_query),
+    )
+    logger.info(f"Verificação de dados para {driver_id} (tempos em ms: {stages})")
     
     # Usar os objetos date para a resposta
     return {
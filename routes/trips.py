@@ -1,8 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Request
-from models import Trip, TripCreate
-from database import trips_collection
+from fastapi import APIRouter, HTTPException, Depends, status, Request, Response
+from models import Trip, TripCreate, BulkInsertResult
+from database import trips_collection, with_driver_key, bump_collection_version
 from auth import get_current_user, get_current_user_expired_ok, SECRET_KEY
-from datetime import datetime
+from utils.pagination import FilteredPageParams, ListFilters, fetch_page
+from utils.export import ExportFormat, export_response
+from utils.bulk import bulk_insert
+from utils.ownership import owned_by, ownership_failure
+from rollups import apply_trip_rollups
+from utils.etag import conditional_get
+from utils.fast_json import fast_json_response
+from datetime import date, datetime
+from pymongo import ReturnDocument
 import logging
 
 router = APIRouter()
@@ -25,17 +33,24 @@ def trip_helper(trip) -> dict:
         "destination": trip.get("destination", "")
     }
 
+def prepare_trip_document(trip: TripCreate, current_user) -> dict:
+    """Converte a viagem recebida no documento gravado no MongoDB"""
+    # Usa o método to_mongo para garantir a conversão correta da data
+    trip_dict = trip.to_mongo()
+    trip_dict["user_id"] = current_user.id
+    return with_driver_key(trip_dict)
+
 # routes/trips.py
 @router.post("/", response_model=Trip)
 async def create_trip(trip: TripCreate, current_user = Depends(get_current_user)):
     try:
-        # Usa o método to_mongo para garantir a conversão correta da data
-        trip_dict = trip.to_mongo()
-        trip_dict["user_id"] = current_user.id
+        trip_dict = prepare_trip_document(trip, current_user)
 
-        new_trip = await trips_collection.insert_one(trip_dict)
-        created_trip = await trips_collection.find_one({"_id": new_trip.inserted_id})
-        return trip_helper(created_trip)
+        # insert_one preenche o _id no próprio documento: não é preciso relê-lo
+        await trips_collection.insert_one(trip_dict)
+        await apply_trip_rollups(added=[trip_dict])
+        await bump_collection_version("trips")
+        return trip_helper(trip_dict)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao criar viagem: {str(e)}")
 
@@ -44,28 +59,31 @@ async def create_trip_no_slash(trip: TripCreate, current_user = Depends(get_curr
     """Endpoint alternativo para criar viagem sem barra no final"""
     return await create_trip(trip, current_user)
 
-@router.get("/", response_model=list[Trip])
-async def get_trips(request: Request):
+async def _after_bulk_insert(trips: list):
+    await apply_trip_rollups(added=trips)
+    await bump_collection_version("trips")
+
+@router.post("/bulk", response_model=BulkInsertResult)
+async def create_trips_bulk(trips: list[dict], current_user = Depends(get_current_user)):
+    """
+    Cria várias viagens em uma requisição (ex.: sincronização de um turno).
+    Itens inválidos não impedem a gravação dos demais e são listados em "errors".
+    """
+    return await bulk_insert(trips_collection, trips, TripCreate,
+                             lambda trip: prepare_trip_document(trip, current_user),
+                             after_insert=_after_bulk_insert)
+
+@router.get("/", response_model=list[Trip], dependencies=[Depends(conditional_get("trips"))])
+async def get_trips(response: Response, page: FilteredPageParams = Depends(),
+                    current_user = Depends(get_current_user_expired_ok)):
     """
-    Retorna todas as viagens do usuário atual.
+    Retorna as viagens, da mais recente para a mais antiga, paginadas por cursor.
+    Filtros opcionais: driver_id, start_date e end_date.
     """
     try:
-        # Usar o middleware para tentar obter o usuário do token
-        auth_header = request.headers.get("Authorization")
-        if not auth_header or not auth_header.startswith("Bearer "):
-            logger.warning("Authorization header inválido ou ausente")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token não fornecido",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-
-        # Tentar buscar viagens sem depender de get_current_user
-        # (temporariamente para diagnóstico)
-        trips = []
-        async for trip in trips_collection.find({}):
-            trips.append(trip_helper(trip))
-        return trips
+        trips = await fetch_page(trips_collection, page, response, trip_helper, sort_field="date")
+        # Codificação direta com orjson; response_model continua documentando a resposta
+        return fast_json_response(trips, response, model=Trip)
     except Exception as e:
         logger.error(f"Erro ao buscar viagens: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -73,23 +91,28 @@ async def get_trips(request: Request):
             detail=f"Erro ao buscar viagens: {str(e)}"
         )
 
-@router.get("", response_model=list[Trip])
-async def get_trips_no_slash(request: Request):
+@router.get("", response_model=list[Trip], dependencies=[Depends(conditional_get("trips"))])
+async def get_trips_no_slash(response: Response, page: FilteredPageParams = Depends(),
+                             current_user = Depends(get_current_user_expired_ok)):
     """Endpoint alternativo para listar viagens sem barra no final"""
-    return await get_trips(request)
+    return await get_trips(response, page, current_user)
+
+TRIP_EXPORT_COLUMNS = ["id", "user_id", "driver_id", "platform", "date", "distance", "earnings", "origin", "destination"]
+
+@router.get("/export")
+async def export_trips(filters: ListFilters = Depends(), export: ExportFormat = Depends(),
+                       current_user = Depends(get_current_user_expired_ok)):
+    """
+    Exporta as viagens em CSV ou NDJSON, em ordem cronológica, via streaming.
+    Filtros opcionais: driver_id, start_date e end_date.
+    """
+    return export_response(trips_collection, filters.filters("date"), trip_helper,
+                           TRIP_EXPORT_COLUMNS, export.format, "viagens")
 
 @router.put("/{trip_id}")
 async def update_trip(trip_id: str, trip_data: TripCreate, current_user = Depends(get_current_user_expired_ok)):
     """Atualiza uma viagem existente"""
     try:
-        # Verifica se a viagem existe e pertence ao usuário
-        existing_trip = await trips_collection.find_one({"_id": ObjectId(trip_id)})
-        if not existing_trip:
-            raise HTTPException(status_code=404, detail="Viagem não encontrada")
-
-        if str(existing_trip.get("user_id")) != current_user.id:
-            raise HTTPException(status_code=403, detail="Sem permissão para atualizar esta viagem")
-
         # Prepara os dados para atualização
         try:
             update_data = trip_data.model_dump()
@@ -101,6 +124,7 @@ async def update_trip(trip_id: str, trip_data: TripCreate, current_user = Depend
         # Garante que driver_id seja string
         if "driver_id" in update_data:
             update_data["driver_id"] = str(update_data["driver_id"])
+            with_driver_key(update_data)
 
         # Converte valores numéricos para float
         if "distance" in update_data:
@@ -112,16 +136,23 @@ async def update_trip(trip_id: str, trip_data: TripCreate, current_user = Depend
         if isinstance(update_data.get("date"), date):
             update_data["date"] = datetime.combine(update_data["date"], datetime.min.time())
 
-        # Atualiza a viagem
-        await trips_collection.update_one(
-            {"_id": ObjectId(trip_id)},
-            {"$set": update_data}
+        # Atualiza a viagem somente se ela pertencer ao usuário. A versão anterior
+        # é retornada para que os totais diários possam ser corrigidos.
+        previous_trip = await trips_collection.find_one_and_update(
+            owned_by(trip_id, current_user),
+            {"$set": update_data},
+            return_document=ReturnDocument.BEFORE
         )
-
-        # Retorna a viagem atualizada
-        updated_trip = await trips_collection.find_one({"_id": ObjectId(trip_id)})
+        if not previous_trip:
+            raise await ownership_failure(trips_collection, trip_id, "Viagem não encontrada",
+                                          "Sem permissão para atualizar esta viagem")
+        updated_trip = {**previous_trip, **update_data}
+        await apply_trip_rollups(added=[updated_trip], removed=[previous_trip])
+        await bump_collection_version("trips")
         return trip_helper(updated_trip)
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar viagem: {str(e)}")
 
@@ -129,21 +160,16 @@ async def update_trip(trip_id: str, trip_data: TripCreate, current_user = Depend
 async def delete_trip(trip_id: str, current_user = Depends(get_current_user_expired_ok)):
     """Exclui uma viagem específica"""
     try:
-        # Verifica se a viagem existe e pertence ao usuário
-        existing_trip = await trips_collection.find_one({"_id": ObjectId(trip_id)})
-        if not existing_trip:
-            raise HTTPException(status_code=404, detail="Viagem não encontrada")
-
-        if str(existing_trip.get("user_id")) != current_user.id:
-            raise HTTPException(status_code=403, detail="Sem permissão para excluir esta viagem")
-
-        # Exclui a viagem
-        result = await trips_collection.delete_one({"_id": ObjectId(trip_id)})
-
-        if result.deleted_count == 1:
-            return {"mensagem": "Viagem excluída com sucesso"}
-        else:
-            raise HTTPException(status_code=404, detail="Viagem não encontrada")
-
+        # Exclui a viagem somente se ela pertencer ao usuário
+        deleted_trip = await trips_collection.find_one_and_delete(owned_by(trip_id, current_user))
+        if not deleted_trip:
+            raise await ownership_failure(trips_collection, trip_id, "Viagem não encontrada",
+                                          "Sem permissão para excluir esta viagem")
+        await apply_trip_rollups(removed=[deleted_trip])
+        await bump_collection_version("trips")
+        return {"mensagem": "Viagem excluída com sucesso"}
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao excluir viagem: {str(e)}")
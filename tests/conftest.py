@@ -0,0 +1,113 @@
+"""
+Ambiente de testes: a aplicação real (main.app) sobre um MongoDB simulado em
+memória (mongomock-motor), com autenticação real (registro + login).
+
+O mongomock não emite eventos de monitoramento de comandos; aqui cada operação
+de coleção gera os eventos que o driver geraria e os entrega ao
+mongo_command_listener da aplicação. Assim a contagem por requisição passa pelo
+mesmo caminho de produção (listener -> RequestDbStats -> Server-Timing).
+"""
+import contextvars
+import functools
+import itertools
+import os
+import sys
+from datetime import timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["MONGO_URI"] = "mongodb://localhost:27017/"
+os.environ["ENSURE_INDEXES_ON_STARTUP"] = "false"
+os.environ["BACKFILL_DRIVER_KEYS_ON_STARTUP"] = "false"
+os.environ["BACKFILL_ROLLUPS_ON_STARTUP"] = "false"
+os.environ["LOG_FILE"] = ""
+# Situação da reconstrução dos totais lida uma vez: a contagem de comandos por requisição fica estável
+os.environ["ROLLUPS_STATE_TTL_SECONDS"] = "3600"
+
+import motor.motor_asyncio
+import pytest
+from mongomock.collection import Collection as MongoMockCollection
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import monitoring
+
+motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+
+from utils.metrics import mongo_command_listener  # noqa: E402
+
+# Operação de coleção -> comando enviado pelo driver
+COMMAND_NAMES = {
+    "find": "find",
+    "find_one": "find",
+    "find_one_and_update": "findAndModify",
+    "find_one_and_replace": "findAndModify",
+    "find_one_and_delete": "findAndModify",
+    "insert_one": "insert",
+    "insert_many": "insert",
+    "update_one": "update",
+    "update_many": "update",
+    "replace_one": "update",
+    "delete_one": "delete",
+    "delete_many": "delete",
+    "bulk_write": "bulkWrite",
+    "aggregate": "aggregate",
+    "count_documents": "aggregate",
+    "distinct": "distinct",
+}
+
+# Comandos emitidos, como (coleção, comando), para inspeção nos testes
+issued_commands = []
+_request_ids = itertools.count(1)
+# Operações do mongomock chamam outras internamente: só a mais externa conta
+_inside_operation = contextvars.ContextVar("inside_operation", default=False)
+
+
+def _emitting(method_name, method):
+    command_name = COMMAND_NAMES[method_name]
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if _inside_operation.get():
+            return method(self, *args, **kwargs)
+        request_id = next(_request_ids)
+        address = ("localhost", 27017)
+        mongo_command_listener.started(monitoring.CommandStartedEvent(
+            {command_name: self.name}, self.database.name, request_id, address, request_id))
+        token = _inside_operation.set(True)
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _inside_operation.reset(token)
+            issued_commands.append((self.name, command_name))
+            mongo_command_listener.succeeded(monitoring.CommandSucceededEvent(
+                timedelta(microseconds=50), {"ok": 1}, command_name, request_id, address, request_id))
+
+    return wrapper
+
+
+for _name in COMMAND_NAMES:
+    setattr(MongoMockCollection, _name, _emitting(_name, getattr(MongoMockCollection, _name)))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    return TestClient(main.app)
+
+
+@pytest.fixture(scope="session")
+def auth_headers(client):
+    credentials = {"username": "motorista_teste", "email": "teste@exemplo.com", "password": "senha-de-teste"}
+    assert client.post("/api/register", json=credentials).status_code == 200
+    response = client.post("/api/login", json={"username": credentials["username"], "password": credentials["password"]})
+    assert response.status_code == 200
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def commands():
+    """Comandos emitidos a partir deste ponto do teste"""
+    issued_commands.clear()
+    return issued_commands
+
@@ -0,0 +1,85 @@
+"""
+A reconstrução completa dos totais diários roda com a API recebendo escritas:
+ao final, driver_daily_rollups deve bater exatamente com os dados brutos.
+"""
+import asyncio
+from datetime import datetime
+
+import httpx
+
+import main
+import rollups
+from database import daily_rollups_collection, expenses_collection, trips_collection
+
+
+def trip(day: int, driver: str, earnings: float) -> dict:
+    return {"driver_id": driver, "platform": "uber", "date": f"2024-07-0{day}", "distance": 3.0,
+            "earnings": earnings, "origin": "Centro", "destination": "Bairro"}
+
+
+async def expected_rollups() -> dict:
+    expected = {}
+    async for doc in trips_collection.find({}):
+        totals = expected.setdefault((doc["driver_key"], rollups.rollup_day(doc["date"])), [0.0, 0, 0.0])
+        totals[0] += doc["earnings"]
+        totals[1] += 1
+    async for doc in expenses_collection.find({}):
+        totals = expected.setdefault((doc["driver_key"], rollups.rollup_day(doc["date"])), [0.0, 0, 0.0])
+        totals[2] += doc["amount"]
+    return {key: tuple(values) for key, values in expected.items()}
+
+
+async def stored_rollups() -> dict:
+    return {
+        (doc["driver_key"], doc["day"]): (doc.get("earnings", 0.0), doc.get("trip_count", 0), doc.get("expenses_total", 0.0))
+        for doc in await daily_rollups_collection.find({}).to_list(length=None)
+    }
+
+
+def test_full_rebuild_under_concurrent_writes(auth_headers, monkeypatch):
+    monkeypatch.setattr(rollups, "ROLLUPS_STATE_TTL_SECONDS", 0.05)
+    stream_updates = rollups._stream_updates
+
+    async def slow_stream_updates(cursor, to_update, collection):
+        # Uma gravação por vez, com pausas: as escritas da API caem no meio da montagem
+        rows = [row async for row in cursor]
+
+        async def one_by_one():
+            for row in rows:
+                await asyncio.sleep(0.005)
+                yield row
+
+        return await stream_updates(one_by_one(), to_update, collection)
+
+    monkeypatch.setattr(rollups, "_stream_updates", slow_stream_updates)
+
+    async def scenario():
+        await trips_collection.insert_many([
+            {"driver_id": f"m{i % 3}", "driver_key": f"m{i % 3}", "platform": "uber",
+             "date": datetime(2024, 7, 1 + i % 5), "distance": 1.0, "earnings": 10.0}
+            for i in range(60)
+        ])
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://teste") as client:
+            async def writes():
+                created = []
+                for i in range(40):
+                    if i % 4 == 3:
+                        response = await client.delete(f"/api/trips/{created.pop()}", headers=auth_headers)
+                    elif i % 4 == 2:
+                        response = await client.put(f"/api/trips/{created[-1]}", json=trip(3, "m1", 11.0),
+                                                    headers=auth_headers)
+                    else:
+                        response = await client.post("/api/trips/", json=trip(1 + i % 5, f"m{i % 3}", 7.0),
+                                                     headers=auth_headers)
+                        created.append(response.json()["id"])
+                    assert response.status_code == 200, response.text
+                    await asyncio.sleep(0.01)
+
+            result, _ = await asyncio.gather(rollups.rebuild_daily_rollups(), writes())
+
+        assert result["recomputed_days"] > 0
+        assert await stored_rollups() == await expected_rollups()
+        assert await rollups.rollups_ready()
+
+    asyncio.run(scenario())
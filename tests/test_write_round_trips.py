@@ -0,0 +1,71 @@
+"""
+Cada alteração e exclusão de viagem, despesa ou meta é uma única operação
+atômica na coleção (find_one_and_update / find_one_and_delete com filtro de
+dono), sem leitura prévia nem releitura. Os demais comandos da requisição são
+os efeitos colaterais fixos: totais diários, invalidação de relatórios (geração
+e marcação) e versão da coleção (ETag).
+"""
+import re
+
+import pytest
+
+# Comandos fora da coleção principal, no máximo: totais diários (bulk_write),
+# geração dos relatórios (bulk_write), relatórios (update_many) e versão da coleção (update_one)
+SIDE_EFFECT_COMMANDS = 4
+
+TRIP = {"driver_id": "Ana", "platform": "uber", "date": "2024-05-01", "distance": 12.5,
+        "earnings": 40.0, "origin": "Centro", "destination": "Aeroporto"}
+EXPENSE = {"user_id": "ignorado", "driver_id": "Ana", "category": "Combustível", "amount": 80.0,
+           "date": "2024-05-01T00:00:00", "description": "Abastecimento"}
+GOAL = {"driver_id": "Ana", "name": "Reserva", "target_amount": 1000.0, "deadline": "2024-12-31"}
+
+RESOURCES = {
+    "trips": (TRIP, {**TRIP, "earnings": 55.0}),
+    "expenses": (EXPENSE, {**EXPENSE, "amount": 95.0}),
+    "goals": (GOAL, {**GOAL, "target_amount": 1500.0}),
+}
+
+
+def db_command_count(response) -> int:
+    """Número de comandos do MongoDB informado no cabeçalho Server-Timing"""
+    match = re.search(r'db;dur=[\d.]+;desc="(\d+) comandos"', response.headers["Server-Timing"])
+    assert match, response.headers.get("Server-Timing")
+    return int(match.group(1))
+
+
+def create(client, auth_headers, resource: str) -> str:
+    response = client.post(f"/api/{resource}/", json=RESOURCES[resource][0], headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+
+@pytest.mark.parametrize("resource", RESOURCES)
+def test_update_is_one_round_trip(client, auth_headers, commands, resource):
+    object_id = create(client, auth_headers, resource)
+    commands.clear()
+
+    response = client.put(f"/api/{resource}/{object_id}", json=RESOURCES[resource][1], headers=auth_headers)
+
+    assert response.status_code == 200, response.text
+    assert [c for c in commands if c[0] == resource] == [(resource, "findAndModify")]
+    assert db_command_count(response) == len(commands) <= 1 + SIDE_EFFECT_COMMANDS
+
+
+@pytest.mark.parametrize("resource", RESOURCES)
+def test_delete_is_one_round_trip(client, auth_headers, commands, resource):
+    object_id = create(client, auth_headers, resource)
+    commands.clear()
+
+    response = client.delete(f"/api/{resource}/{object_id}", headers=auth_headers)
+
+    assert response.status_code == 200, response.text
+    assert [c for c in commands if c[0] == resource] == [(resource, "findAndModify")]
+    assert db_command_count(response) == len(commands) <= 1 + SIDE_EFFECT_COMMANDS
+
+
+@pytest.mark.parametrize("resource", RESOURCES)
+def test_missing_document_costs_one_extra_lookup(client, auth_headers, commands, resource):
+    response = client.delete(f"/api/{resource}/{'0' * 24}", headers=auth_headers)
+
+    assert response.status_code == 404
+    assert [c for c in commands if c[0] == resource] == [(resource, "findAndModify"), (resource, "find")]
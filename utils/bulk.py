@@ -0,0 +1,62 @@
+"""
+Inserção em lote: valida cada item individualmente e grava os válidos com um
+único insert_many não ordenado, reportando erros por posição no lote.
+"""
+import logging
+from typing import Awaitable, Callable, List, Optional, Type
+
+from fastapi import HTTPException
+from pydantic import BaseModel, ValidationError
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+BULK_MAX_ITEMS = 1000
+
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
+
+
+async def bulk_insert(collection, items: List[dict], model: Type[BaseModel], prepare: Callable,
+                      after_insert: Optional[Callable[[List[dict]], Awaitable]] = None) -> dict:
+    """
+    Valida `items` com `model`, converte os válidos com `prepare` e os insere.
+    Retorna {"inserted_ids": [...], "errors": [{"index": ..., "error": ...}]},
+    com os ids na ordem dos itens enviados. `after_insert`, se informado, recebe
+    os documentos efetivamente gravados.
+    """
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Lote excede o limite de {BULK_MAX_ITEMS} itens")
+
+    errors = []
+    documents = []
+    positions = []
+    for index, item in enumerate(items):
+        try:
+            documents.append(prepare(model.model_validate(item)))
+            positions.append(index)
+        except ValidationError as e:
+            errors.append({"index": index, "error": _validation_message(e)})
+        except (TypeError, ValueError) as e:
+            errors.append({"index": index, "error": str(e)})
+
+    failed = set()
+    if documents:
+        try:
+            await collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get("writeErrors", []):
+                failed.add(write_error["index"])
+                errors.append({"index": positions[write_error["index"]], "error": write_error.get("errmsg", "")})
+            logger.warning(f"Inserção em lote em {collection.name}: {len(failed)} falhas de escrita")
+
+    inserted = [doc for position, doc in enumerate(documents) if position not in failed]
+    if inserted and after_insert:
+        await after_insert(inserted)
+
+    inserted_ids = [str(doc["_id"]) for doc in inserted]
+    errors.sort(key=lambda item: item["index"])
+    return {"inserted_ids": inserted_ids, "errors": errors}
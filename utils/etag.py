@@ -0,0 +1,42 @@
+"""
+GET condicional (ETag / If-None-Match) para listagens e detalhes.
+
+O ETag deriva da versão da coleção (incrementada a cada escrita), da URL e do
+usuário autenticado. Se o cliente envia o ETag atual, a resposta é 304 sem executar
+a consulta nem serializar nada: o custo é uma leitura de documento por _id.
+A dependência exige autenticação, então tokens ausentes ou inválidos recebem 401
+antes de qualquer 304.
+"""
+import hashlib
+
+from fastapi import Depends, HTTPException, Request, Response
+
+from auth import get_current_user_expired_ok
+from database import get_collection_version
+
+
+def _etag(collection: str, version: int, request: Request, username: str) -> str:
+    raw = f"{version}|{username}|{request.url.path}?{request.url.query}"
+    return f'W/"{collection}-{version}-{hashlib.sha1(raw.encode()).hexdigest()[:16]}"'
+
+
+def _matches(header: str, etag: str) -> bool:
+    candidates = {item.strip() for item in header.split(",")}
+    # Comparação fraca: W/"x" e "x" são equivalentes. "*" não é aceito: responderia
+    # 304 até para recursos inexistentes, que devem receber 404
+    return etag in candidates or etag[2:] in candidates
+
+
+def conditional_get(collection: str):
+    """Dependência que responde 304 quando If-None-Match corresponde à versão atual"""
+
+    async def dependency(request: Request, response: Response,
+                         current_user=Depends(get_current_user_expired_ok)):
+        etag = _etag(collection, await get_collection_version(collection), request, current_user.username)
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache", "Vary": "Authorization"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and _matches(if_none_match, etag):
+            raise HTTPException(status_code=304, headers=headers)
+        response.headers.update(headers)
+
+    return dependency
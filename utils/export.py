@@ -0,0 +1,96 @@
+"""
+Exportação em streaming (CSV ou NDJSON) de documentos lidos de um cursor do Motor.
+As linhas são serializadas e enviadas em lotes conforme chegam do banco, então o
+uso de memória não depende do total de registros exportados.
+"""
+import csv
+import io
+import json
+import logging
+from datetime import date, datetime
+from enum import Enum
+from typing import AsyncIterator, Callable, List
+
+from fastapi import Query
+from fastapi.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+# Linhas acumuladas antes de cada envio ao cliente
+EXPORT_FLUSH_ROWS = 500
+# Documentos trazidos do MongoDB por lote
+EXPORT_CURSOR_BATCH_SIZE = 1000
+
+
+class ExportFormat:
+    """Parâmetro de formato da exportação (usado como dependência nas rotas)"""
+
+    def __init__(self, format: str = Query("csv", pattern="^(csv|ndjson)$", description="csv ou ndjson")):
+        self.format = format
+
+
+def _plain(value):
+    """Converte valores do documento para tipos simples de CSV/JSON"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    return value
+
+
+async def export_rows(cursor, helper: Callable, columns: List[str], fmt: str) -> AsyncIterator[bytes]:
+    """Gera o conteúdo da exportação em blocos de bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+
+    if writer:
+        writer.writerow(columns)
+        # Cabeçalho enviado imediatamente: o primeiro byte não espera pelo banco
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    pending = 0
+    try:
+        async for doc in cursor:
+            try:
+                row = helper(doc)
+            except KeyError as e:
+                logger.warning(f"Documento {doc.get('_id')} ignorado na exportação: campo ausente {str(e)}")
+                continue
+
+            values = [_plain(row.get(column)) for column in columns]
+            if writer:
+                writer.writerow(values)
+            else:
+                buffer.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False))
+                buffer.write("\n")
+
+            pending += 1
+            if pending >= EXPORT_FLUSH_ROWS:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+                pending = 0
+    except Exception as e:
+        # O status HTTP já foi enviado; só resta registrar e encerrar o stream
+        logger.error(f"Erro durante exportação: {str(e)}", exc_info=True)
+        raise
+
+    if pending:
+        yield buffer.getvalue().encode()
+
+
+def export_response(collection, query: dict, helper: Callable, columns: List[str],
+                    fmt: str, filename: str, sort_field: str = "date") -> StreamingResponse:
+    """Monta a resposta em streaming para os documentos que atendem à consulta"""
+    cursor = collection.find(query).sort([(sort_field, 1), ("_id", 1)]).batch_size(EXPORT_CURSOR_BATCH_SIZE)
+    return StreamingResponse(
+        export_rows(cursor, helper, columns, fmt),
+        media_type=EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
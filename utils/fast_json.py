@@ -0,0 +1,81 @@
+"""
+Caminho rápido de serialização para listagens grandes.
+
+A saída dos helpers (trip_helper, expense_helper, ...) é codificada direto para
+bytes com orjson, sem a validação repetida contra o response_model. Como a rota
+retorna um Response pronto, o FastAPI não valida nem reserializa o conteúdo, mas
+o response_model declarado continua documentando a resposta no OpenAPI.
+
+Sem orjson instalado, usa o módulo json padrão (mesmo formato, menor velocidade).
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+from functools import lru_cache
+from typing import Optional, Type
+
+from bson import ObjectId
+from fastapi import Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+
+def _default(value):
+    """Tipos que o codificador não conhece nativamente"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Tipo não serializável em JSON: {type(value).__name__}")
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+@lru_cache(maxsize=None)
+def _date_only_fields(model: Type[BaseModel]) -> tuple:
+    """Campos declarados como date (sem hora): o modelo os serializaria como AAAA-MM-DD"""
+    return tuple(name for name, field in model.model_fields.items() if field.annotation is date)
+
+
+def fast_json_response(items: list, response: Optional[Response] = None,
+                       model: Optional[Type[BaseModel]] = None) -> FastJSONResponse:
+    """
+    Monta a resposta JSON de uma lista de dicionários já no formato do modelo.
+
+    `model` ajusta apenas o que o response_model mudaria na saída (datetime em
+    campos date). Os cabeçalhos definidos em `response` por dependências e
+    handlers (ETag, X-Next-Page-Token) são mantidos.
+    """
+    if model is not None:
+        date_fields = _date_only_fields(model)
+        if date_fields:
+            for item in items:
+                for name in date_fields:
+                    value = item.get(name)
+                    if isinstance(value, datetime):
+                        item[name] = value.date()
+
+    result = FastJSONResponse(items)
+    if response is not None:
+        for name, value in response.headers.items():
+            if name != "content-length":
+                result.headers[name] = value
+        if response.status_code:
+            result.status_code = response.status_code
+    return result
@@ -0,0 +1,101 @@
+"""
+Registro de chaves de assinatura JWT identificadas por `kid`.
+Tokens novos levam o `kid` da chave ativa no header, permitindo que a verificação
+use diretamente a chave correta em vez de testar todas as chaves conhecidas.
+"""
+import hashlib
+import secrets
+from typing import Dict, List, Optional
+
+
+def key_id_for(secret: str) -> str:
+    """Deriva um identificador estável (e não reversível) para a chave"""
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def generate_secret() -> str:
+    """Nova chave de assinatura aleatória (chaves nunca vêm de fora do servidor)"""
+    return secrets.token_hex(32)
+
+
+class KeyRegistry:
+    """
+    Mantém as chaves conhecidas, qual delas assina novos tokens e a ordem
+    das chaves usadas na verificação de tokens legados (sem `kid`).
+    As chaves podem ser rotacionadas ou removidas em tempo de execução (ver sync).
+    """
+
+    def __init__(self, legacy_fallback_limit: int = 4):
+        self._keys: Dict[str, str] = {}
+        self._legacy_order: List[str] = []
+        self.active_kid: Optional[str] = None
+        self.legacy_fallback_limit = legacy_fallback_limit
+
+    def register(self, secret: str, activate: bool = False, legacy: bool = True) -> str:
+        """
+        Registra uma chave e retorna seu `kid`. Chaves marcadas como `legacy`
+        participam da verificação de tokens emitidos antes do uso de `kid`.
+        """
+        kid = key_id_for(secret)
+        self._keys[kid] = secret
+        if legacy and kid not in self._legacy_order:
+            self._legacy_order.append(kid)
+        if activate:
+            self.active_kid = kid
+        return kid
+
+    def retire(self, kid: str) -> bool:
+        """Remove uma chave; tokens assinados com ela deixam de ser aceitos"""
+        if kid == self.active_kid:
+            raise ValueError("Não é possível remover a chave de assinatura ativa")
+        if kid in self._legacy_order:
+            self._legacy_order.remove(kid)
+        return self._keys.pop(kid, None) is not None
+
+    def sync(self, stored: List[dict]) -> dict:
+        """
+        Aplica as chaves persistidas (documentos {_id: kid, secret, active, retired},
+        em ordem de criação), compartilhadas entre os workers da aplicação.
+        Retorna o que mudou: kids adicionados, kid ativado e kids removidos.
+        """
+        changes = {"added": [], "activated": None, "retired": []}
+        active = None
+        for doc in stored:
+            if doc.get("retired") or not doc.get("secret"):
+                continue
+            if doc["_id"] not in self._keys:
+                self.register(doc["secret"], legacy=False)
+                changes["added"].append(doc["_id"])
+            if doc.get("active"):
+                active = doc["_id"]
+        if active and active != self.active_kid:
+            self.active_kid = active
+            changes["activated"] = active
+        for doc in stored:
+            kid = doc["_id"]
+            if doc.get("retired") and kid in self._keys and kid != self.active_kid:
+                self.retire(kid)
+                changes["retired"].append(kid)
+        return changes
+
+    def get(self, kid: str) -> Optional[str]:
+        return self._keys.get(kid)
+
+    def active(self) -> tuple[str, str]:
+        """Retorna (kid, chave) da chave usada para assinar novos tokens"""
+        return self.active_kid, self._keys[self.active_kid]
+
+    def legacy_keys(self) -> List[tuple[str, str]]:
+        """Chaves testadas, em ordem, para tokens sem `kid` (limitadas a legacy_fallback_limit)"""
+        return [(kid, self._keys[kid]) for kid in self._legacy_order[:self.legacy_fallback_limit]]
+
+    def describe(self) -> List[dict]:
+        """Lista as chaves conhecidas sem expor seus valores"""
+        return [
+            {
+                "kid": kid,
+                "active": kid == self.active_kid,
+                "legacy_fallback": kid in self._legacy_order[:self.legacy_fallback_limit],
+            }
+            for kid in self._keys
+        ]
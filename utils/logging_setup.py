@@ -0,0 +1,142 @@
+"""
+Configuração central de logs.
+
+Os registros são colocados numa fila (QueueHandler) e gravados por uma thread
+separada (QueueListener): a escrita em disco e a formatação saem do caminho das
+requisições. O arquivo recebe uma linha JSON por registro, com os campos extras
+passados em `extra=`; o console recebe texto.
+
+Variáveis de ambiente:
+    LOG_LEVEL                 nível padrão (INFO)
+    LOG_LEVELS                níveis por logger, ex.: "routes.trips=DEBUG,auth=WARNING"
+    LOG_FILE                  arquivo de saída (api.log; vazio desativa)
+    LOG_QUEUE_SIZE            registros pendentes antes de descartar novos (10000)
+    LOG_REQUEST_SAMPLE_RATE   fração das linhas por requisição mantidas (0.01)
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# Carrega variáveis de ambiente (a configuração de logs roda antes dos demais módulos)
+load_dotenv()
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FILE = os.getenv("LOG_FILE", "api.log")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_REQUEST_SAMPLE_RATE = float(os.getenv("LOG_REQUEST_SAMPLE_RATE", "0.01"))
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Atributos padrão de LogRecord; os demais vieram de `extra=` e vão para o JSON
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "sample"}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Um objeto JSON por linha: horário, nível, logger, mensagem e campos extras"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                data[key] = value
+        if record.exc_info:
+            data["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RequestSampler(logging.Filter):
+    """Mantém só uma fração dos registros marcados com extra={"sample": True} abaixo de WARNING"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "sample", False) and record.levelno < logging.WARNING:
+            return random.random() < self.rate
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Enfileira o registro sem formatá-lo (a formatação fica com a thread do
+    listener). Com a fila cheia, o registro é descartado e contado, em vez de
+    bloquear a requisição.
+    """
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve os argumentos agora: podem ser alterados depois pelo chamador
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+
+def _parse_levels(spec: str) -> dict:
+    levels = {}
+    for item in spec.split(","):
+        if "=" in item:
+            name, level = item.split("=", 1)
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Configura o logger raiz (uma única vez) e inicia a thread de escrita"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handlers = []
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers.append(console)
+    if LOG_FILE:
+        file_handler = logging.FileHandler(LOG_FILE)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    queue_handler = NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestSampler(LOG_REQUEST_SAMPLE_RATE))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in _parse_levels(LOG_LEVELS).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Grava os registros pendentes e encerra a thread de escrita"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,200 @@
+"""
+Métricas da aplicação no formato de texto do Prometheus, servidas em /metrics.
+
+Implementação mínima (contadores, gauges e histogramas com rótulos), segura para
+uso a partir de várias threads: os eventos de comando do pymongo chegam pelas
+threads do driver, fora do event loop.
+"""
+import threading
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import monitoring
+
+# Limites (em segundos) dos histogramas de latência
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_label_text(key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        # rótulos -> [contagem por faixa..., soma, total]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(key, list(data)) for key, data in self._values.items()]
+        lines = self.header()
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {data[-1]}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {data[-2]}")
+            lines.append(f"{self.name}_count{_label_text(key)} {data[-1]}")
+        return lines
+
+
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Duração das requisições HTTP por rota")
+http_requests_in_flight = Gauge(
+    "http_requests_in_flight", "Requisições HTTP em andamento")
+jwt_verification_duration = Histogram(
+    "jwt_verification_duration_seconds", "Tempo de verificação de tokens JWT por resultado",
+    buckets=(0.00001, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01))
+mongo_command_duration = Histogram(
+    "mongodb_command_duration_seconds", "Duração dos comandos do MongoDB por coleção e comando")
+mongo_command_failures = Counter(
+    "mongodb_command_failures_total", "Comandos do MongoDB que falharam, por coleção e comando")
+http_request_db_commands = Histogram(
+    "http_request_db_commands", "Comandos do MongoDB enviados por requisição, por rota",
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21, 50, 100))
+http_request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Tempo total em comandos do MongoDB por requisição, por rota")
+
+REGISTRY = [
+    http_request_duration,
+    http_requests_in_flight,
+    jwt_verification_duration,
+    mongo_command_duration,
+    mongo_command_failures,
+    http_request_db_commands,
+    http_request_db_duration,
+]
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class RequestDbStats:
+    """Comandos do MongoDB e tempo total gasto neles durante uma requisição"""
+
+    def __init__(self):
+        self.commands = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.commands += 1
+            self.seconds += seconds
+
+    def server_timing(self) -> str:
+        """Valor para o cabeçalho Server-Timing (duração em milissegundos)"""
+        return f'db;dur={self.seconds * 1000:.2f};desc="{self.commands} comandos"'
+
+
+# O Motor executa cada operação com uma cópia do contexto da tarefa, então o
+# listener (em outra thread) enxerga o mesmo objeto criado pelo middleware
+current_db_stats: ContextVar[Optional[RequestDbStats]] = ContextVar("current_db_stats", default=None)
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Registra duração e falhas de cada comando enviado ao MongoDB"""
+
+    def __init__(self):
+        self._pending: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _collection(event: monitoring.CommandStartedEvent) -> str:
+        command = event.command
+        if event.command_name == "getMore":
+            return str(command.get("collection", ""))
+        value = command.get(event.command_name)
+        return value if isinstance(value, str) else ""
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = self._collection(event)
+
+    def _finish(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), "")
+
+    def _record(self, event) -> str:
+        collection = self._finish(event)
+        seconds = event.duration_micros / 1_000_000
+        mongo_command_duration.observe(seconds, collection=collection, command=event.command_name)
+        stats = current_db_stats.get()
+        if stats is not None:
+            stats.add(seconds)
+        return collection
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        self._record(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        collection = self._record(event)
+        mongo_command_failures.inc(collection=collection, command=event.command_name)
+
+
+mongo_command_listener = MongoCommandMetrics()
@@ -0,0 +1,18 @@
+"""
+Filtros de posse para operações atômicas (find_one_and_update/delete) e
+diagnóstico do motivo de falha, feito apenas quando a operação não encontra o documento.
+"""
+from bson import ObjectId
+from fastapi import HTTPException
+
+
+def owned_by(object_id: str, current_user) -> dict:
+    """Filtro que só encontra o documento se ele pertencer ao usuário"""
+    return {"_id": ObjectId(object_id), "user_id": current_user.id}
+
+
+async def ownership_failure(collection, object_id: str, not_found: str, forbidden: str) -> HTTPException:
+    """Distingue documento inexistente (404) de documento de outro usuário (403)"""
+    if await collection.find_one({"_id": ObjectId(object_id)}, {"_id": 1}):
+        return HTTPException(status_code=403, detail=forbidden)
+    return HTTPException(status_code=404, detail=not_found)
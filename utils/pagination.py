@@ -0,0 +1,145 @@
+"""
+Paginação por cursor (keyset) para os endpoints de listagem.
+
+Os documentos são ordenados do mais recente para o mais antigo por (campo, _id)
+e cada página termina com um token opaco que indica onde a próxima começa.
+O token é retornado no cabeçalho X-Next-Page-Token, mantendo o corpo da
+resposta como uma lista simples.
+"""
+import base64
+import binascii
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Callable, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException, Query, Response
+
+from database import driver_filter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_PAGE_HEADER = "X-Next-Page-Token"
+
+
+def encode_page_token(value, doc_id: ObjectId) -> str:
+    """Codifica a posição (valor do campo de ordenação, _id) do último item da página"""
+    if isinstance(value, datetime):
+        encoded_value = {"dt": value.isoformat()}
+    else:
+        encoded_value = {"v": value}
+    raw = json.dumps({"k": encoded_value, "id": str(doc_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_page_token(token: str) -> tuple:
+    """Decodifica um token de página; tokens inválidos geram erro 400"""
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        data = json.loads(raw)
+        encoded_value = data["k"]
+        value = datetime.fromisoformat(encoded_value["dt"]) if "dt" in encoded_value else encoded_value["v"]
+        return value, ObjectId(data["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Token de página inválido")
+
+
+class PageParams:
+    """Parâmetros de paginação comuns (usado como dependência nas rotas)"""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Itens por página"),
+        page_token: Optional[str] = Query(None, description="Token retornado em X-Next-Page-Token"),
+    ):
+        self.limit = limit
+        self.cursor = decode_page_token(page_token) if page_token else None
+
+    def filters(self, date_field: Optional[str] = None) -> dict:
+        return {}
+
+
+class ListFilters:
+    """Filtros por motorista (pela driver_key, independente de caixa/espaços) e
+    intervalo de datas (inclusivo), usados como dependência"""
+
+    def __init__(
+        self,
+        driver_id: Optional[str] = Query(None, description="Filtra por motorista"),
+        start_date: Optional[date] = Query(None, description="Data inicial (inclusiva)"),
+        end_date: Optional[date] = Query(None, description="Data final (inclusiva)"),
+    ):
+        self.driver_id = driver_id
+        self.start_date = start_date
+        self.end_date = end_date
+
+    def filters(self, date_field: Optional[str] = None) -> dict:
+        query = {}
+        if self.driver_id:
+            query.update(driver_filter(self.driver_id))
+        if date_field and (self.start_date or self.end_date):
+            date_range = {}
+            if self.start_date:
+                date_range["$gte"] = datetime.combine(self.start_date, time.min)
+            if self.end_date:
+                date_range["$lt"] = datetime.combine(self.end_date + timedelta(days=1), time.min)
+            query[date_field] = date_range
+        return query
+
+
+class FilteredPageParams(PageParams, ListFilters):
+    """Paginação com filtros por motorista e intervalo de datas"""
+
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Itens por página"),
+        page_token: Optional[str] = Query(None, description="Token retornado em X-Next-Page-Token"),
+        driver_id: Optional[str] = Query(None, description="Filtra por motorista"),
+        start_date: Optional[date] = Query(None, description="Data inicial (inclusiva)"),
+        end_date: Optional[date] = Query(None, description="Data final (inclusiva)"),
+    ):
+        PageParams.__init__(self, limit, page_token)
+        ListFilters.__init__(self, driver_id, start_date, end_date)
+
+    filters = ListFilters.filters
+
+
+async def fetch_page(collection, params: PageParams, response: Response, helper: Callable,
+                     sort_field: Optional[str] = None, query: Optional[dict] = None) -> list:
+    """
+    Busca uma página de documentos ordenados por (sort_field, _id) decrescente,
+    convertendo cada um com `helper`. Documentos que o helper não consegue converter
+    são ignorados. Se houver mais itens, define o cabeçalho X-Next-Page-Token.
+    """
+    query = {**params.filters(sort_field), **(query or {})}
+    sort = [(sort_field, -1), ("_id", -1)] if sort_field else [("_id", -1)]
+
+    if params.cursor is not None:
+        value, last_id = params.cursor
+        if sort_field:
+            keyset = {"$or": [
+                {sort_field: {"$lt": value}},
+                {sort_field: value, "_id": {"$lt": last_id}},
+            ]}
+        else:
+            keyset = {"_id": {"$lt": last_id}}
+        query = {"$and": [query, keyset]} if query else keyset
+
+    docs = await collection.find(query).sort(sort).limit(params.limit + 1).to_list(length=params.limit + 1)
+
+    items = []
+    for doc in docs[:params.limit]:
+        try:
+            items.append(helper(doc))
+        except KeyError as e:
+            # Log do erro e continua sem adicionar o documento problemático
+            logger.warning(f"Documento {doc.get('_id')} ignorado na listagem: campo ausente {str(e)}")
+
+    if len(docs) > params.limit:
+        last = docs[params.limit - 1]
+        response.headers[NEXT_PAGE_HEADER] = encode_page_token(last.get(sort_field) if sort_field else None, last["_id"])
+    return items
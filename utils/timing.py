@@ -0,0 +1,20 @@
+"""
+Medição de tempo por etapa para consultas executadas em paralelo.
+"""
+import asyncio
+import time
+from typing import Awaitable, Dict
+
+
+async def timed(stages: Dict[str, float], name: str, awaitable: Awaitable):
+    """Aguarda `awaitable` e registra em `stages[name]` a duração em milissegundos"""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    finally:
+        stages[name] = round((time.perf_counter() - start) * 1000, 2)
+
+
+async def gather_timed(stages: Dict[str, float], **awaitables: Awaitable) -> list:
+    """Executa as consultas ao mesmo tempo, na ordem dos argumentos, registrando a duração de cada uma"""
+    return await asyncio.gather(*(timed(stages, name, awaitable) for name, awaitable in awaitables.items()))